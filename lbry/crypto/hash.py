@@ -15,14 +15,12 @@ def sha512(x):
 
 def ripemd160(x):
     """ Simple wrapper of hashlib ripemd160. """
-    h = hashlib.new('ripemd160')
-    h.update(x)
-    return h.digest()
+    return hashlib.new('ripemd160', x).digest()
 
 
 def double_sha256(x):
     """ SHA-256 of SHA-256, as used extensively in bitcoin. """
-    return sha256(sha256(x))
+    return hashlib.sha256(hashlib.sha256(x).digest()).digest()
 
 
 def hmac_sha512(key, msg):
@@ -33,7 +31,7 @@ def hmac_sha512(key, msg):
 def hash160(x):
     """ RIPEMD-160 of SHA-256.
         Used to make bitcoin addresses from pubkeys. """
-    return ripemd160(sha256(x))
+    return hashlib.new('ripemd160', hashlib.sha256(x).digest()).digest()
 
 
 def hash_to_hex_str(x):
@@ -1,18 +1,25 @@
 import time
+import array
+import hashlib
 import asyncio
 import typing
 from bisect import bisect_right
-from struct import pack, unpack
+from itertools import chain
+from operator import itemgetter
+import struct
+from sys import intern
 from concurrent.futures.thread import ThreadPoolExecutor
 from typing import Optional, List, Tuple, Set, DefaultDict, Dict, NamedTuple
 from prometheus_client import Gauge, Histogram
 from collections import defaultdict
 
 import lbry
-from lbry.schema.url import URL
+from lbry.schema.url import URL, normalize_name
 from lbry.schema.claim import Claim
 from lbry.wallet.ledger import Ledger, TestNetLedger, RegTestLedger
+from lbry.wallet.bip32 import PublicKey
 from lbry.utils import LRUCache
+from lbry.wallet.script import OP_CLAIM_NAME, OP_UPDATE_CLAIM, OP_SUPPORT_CLAIM
 from lbry.wallet.transaction import OutputScript, Output, Transaction
 from lbry.wallet.server.tx import Tx, TxOutput, TxInput
 from lbry.wallet.server.daemon import DaemonError
@@ -23,7 +30,7 @@ from lbry.wallet.server.mempool import MemPool
 from lbry.wallet.server.db.prefixes import ACTIVATED_SUPPORT_TXO_TYPE, ACTIVATED_CLAIM_TXO_TYPE
 from lbry.wallet.server.db.prefixes import PendingActivationKey, PendingActivationValue, ClaimToTXOValue
 from lbry.wallet.server.udp import StatusServer
-from lbry.wallet.server.db.revertable import RevertableOpStack
+from lbry.wallet.server.db.revertable import RevertableOpStack, RevertablePut, RevertableDelete
 if typing.TYPE_CHECKING:
     from lbry.wallet.server.leveldb import LevelDB
 
@@ -166,7 +173,7 @@ class StagedClaimtrieItem(typing.NamedTuple):
 
     @property
     def is_update(self) -> bool:
-        return (self.tx_num, self.position) != (self.root_tx_num, self.root_position)
+        return self.tx_num != self.root_tx_num or self.position != self.root_position
 
     def invalidate_signature(self) -> 'StagedClaimtrieItem':
         return StagedClaimtrieItem(
@@ -175,6 +182,27 @@ class StagedClaimtrieItem(typing.NamedTuple):
         )
 
 
+NOUT_STRUCT = struct.Struct(b'>I')
+
+
+def txo_key(tx_num: int, nout: int) -> int:
+    return (tx_num << 32) | nout
+
+
+def split_txo_key(key: int) -> Tuple[int, int]:
+    return key >> 32, key & 0xffffffff
+
+
+CLAIM_SCRIPT_OPCODES = frozenset((OP_CLAIM_NAME, OP_UPDATE_CLAIM, OP_SUPPORT_CLAIM))
+
+
+def has_claim_outputs(tx: Tx) -> bool:
+    for txout in tx.outputs:
+        if txout.pk_script and txout.pk_script[0] in CLAIM_SCRIPT_OPCODES:
+            return True
+    return False
+
+
 NAMESPACE = "wallet_server"
 HISTOGRAM_BUCKETS = (
     .005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0, float('inf')
@@ -204,7 +232,6 @@ class BlockProcessor:
         self.db = db
         self.daemon = daemon
         self._chain_executor = ThreadPoolExecutor(1, thread_name_prefix='block-processor')
-        self._sync_reader_executor = ThreadPoolExecutor(1, thread_name_prefix='hub-es-sync')
         self.mempool = MemPool(env.coin, daemon, db, self.state_lock)
         self.shutdown_event = shutdown_event
         self.coin = env.coin
@@ -245,37 +272,44 @@ class BlockProcessor:
         #################################
 
         self.taken_over_names: Set[str] = set()
+        # the pending txo dicts below are keyed by txo_key(tx_num, nout) rather than (tx_num, nout) tuples
         # txo to pending claim
-        self.txo_to_claim: Dict[Tuple[int, int], StagedClaimtrieItem] = {}
+        self.txo_to_claim: Dict[int, StagedClaimtrieItem] = {}
         # claim hash to pending claim txo
-        self.claim_hash_to_txo: Dict[bytes, Tuple[int, int]] = {}
+        self.claim_hash_to_txo: Dict[bytes, int] = {}
+        # signing channel hash to the pending claims with valid signatures from it {channel_hash: {claim_hash: None}}
+        self.pending_signed_claims_by_channel: DefaultDict[bytes, Dict[bytes, None]] = defaultdict(dict)
         # claim hash to lists of pending support txos
-        self.support_txos_by_claim: DefaultDict[bytes, List[Tuple[int, int]]] = defaultdict(list)
+        self.support_txos_by_claim: DefaultDict[bytes, List[int]] = defaultdict(list)
         # support txo: (supported claim hash, support amount)
-        self.support_txo_to_claim: Dict[Tuple[int, int], Tuple[bytes, int]] = {}
-        # removed supports {name: {claim_hash: [(tx_num, nout), ...]}}
-        self.removed_support_txos_by_name_by_claim: DefaultDict[str, DefaultDict[bytes, List[Tuple[int, int]]]] = \
-            defaultdict(lambda: defaultdict(list))
+        self.support_txo_to_claim: Dict[int, Tuple[bytes, int]] = {}
+        # removed supports {(name, claim_hash): {txo_key(tx_num, nout), ...}}
+        self.removed_support_txos_by_name_by_claim: Dict[Tuple[str, bytes], Set[int]] = {}
         self.abandoned_claims: Dict[bytes, StagedClaimtrieItem] = {}
         self.updated_claims: Set[bytes] = set()
-        # removed activated support amounts by claim hash
-        self.removed_active_support_amount_by_claim: DefaultDict[bytes, List[int]] = defaultdict(list)
-        # pending activated support amounts by claim hash
-        self.activated_support_amount_by_claim: DefaultDict[bytes, List[int]] = defaultdict(list)
+        # total removed activated support amount by claim hash
+        self.removed_active_support_amount_by_claim: DefaultDict[bytes, int] = defaultdict(int)
+        # total pending activated support amount by claim hash
+        self.activated_support_amount_by_claim: DefaultDict[bytes, int] = defaultdict(int)
         # pending activated name and claim hash to claim/update txo amount
         self.activated_claim_amount_by_name_and_hash: Dict[Tuple[str, bytes], int] = {}
-        # pending claim and support activations per claim hash per name,
-        # used to process takeovers due to added activations
-        activation_by_claim_by_name_type = DefaultDict[str, DefaultDict[bytes, List[Tuple[PendingActivationKey, int]]]]
-        self.activation_by_claim_by_name: activation_by_claim_by_name_type = defaultdict(lambda: defaultdict(list))
+        # claim hashes with pending claim or support activations per name, used to process takeovers due to added
+        # activations. the inner dicts are used as insertion ordered sets, the order breaks ties between amounts
+        self.activation_by_claim_by_name: DefaultDict[str, Dict[bytes, None]] = defaultdict(dict)
         # these are used for detecting early takeovers by not yet activated claims/supports
-        self.possible_future_support_amounts_by_claim_hash: DefaultDict[bytes, List[int]] = defaultdict(list)
+        self.possible_future_support_amounts_by_claim_hash: DefaultDict[bytes, int] = defaultdict(int)
         self.possible_future_claim_amount_by_name_and_hash: Dict[Tuple[str, bytes], int] = {}
         self.possible_future_support_txos_by_claim_hash: DefaultDict[bytes, List[Tuple[int, int]]] = defaultdict(list)
 
         self.removed_claims_to_send_es = set()  # cumulative changes across blocks to send ES
         self.touched_claims_to_send_es = set()
-        self.activation_info_to_send_es: DefaultDict[str, List[TrendingNotification]] = defaultdict(list)
+        self.activation_info_to_send_es: DefaultDict[bytes, List[TrendingNotification]] = defaultdict(list)
+        # snapshots of the above waiting to be sent to ES by _es_worker
+        self._es_queue: Optional[asyncio.Queue] = None
+        self._es_task: Optional[asyncio.Task] = None
+        self.es_sync_height = 0
+        # claim_id -> digest of the last document sent to ES, used to skip re-sending unchanged claims
+        self._es_doc_cache = LRUCache(2 ** 14)
 
         self.removed_claim_hashes: Set[bytes] = set()  # per block changes
         self.touched_claim_hashes: Set[bytes] = set()
@@ -287,29 +321,128 @@ class BlockProcessor:
         self.pending_support_amount_change = defaultdict(lambda: 0)
 
         self.pending_channels = {}
+        # committed claim txos read while advancing the block
+        self.claim_txo_cache: Dict[bytes, Optional[ClaimToTXOValue]] = {}
+        # committed channel claim hash to public key bytes, kept across blocks
+        self.channel_pub_key_cache = LRUCache(2 ** 13)
+        # public key bytes to parsed keys used to verify channel signatures
+        self.channel_verifying_key_cache = LRUCache(2 ** 13)
+        # name -> controlling claim as of the last flushed block, kept across blocks
+        self.controlling_claim_cache = LRUCache(2 ** 17)
         self.amount_cache = {}
+        self.effective_amount_cache: Dict[Tuple[str, bytes, Optional[int]], int] = {}
+        self.claims_for_name_cache: Dict[str, List[bytes]] = {}
         self.expired_claim_hashes: Set[bytes] = set()
 
         self.doesnt_have_valid_signature: Set[bytes] = set()
         self.claim_channels: Dict[bytes, bytes] = {}
-        self.hashXs_by_tx: DefaultDict[bytes, List[int]] = defaultdict(list)
+        # tx nums are kept as packed uint32 arrays, which is also how they're written to the db
+        self.hashXs_by_tx: DefaultDict[bytes, array.array] = defaultdict(lambda: array.array('I'))
 
         self.pending_transaction_num_mapping: Dict[bytes, int] = {}
         self.pending_transactions: Dict[int, bytes] = {}
 
-    async def claim_producer(self):
+    def _read_es_update(self, touched_claims: Set[bytes]):
+        """Read the claim documents and blocking/filtering reposts to send to ES.
+
+        Called with the state lock held between blocks, so that the update is a consistent snapshot of the db
+        at the current height even if it's sent while the next blocks are being advanced.
+        """
+        claims = self.db.claims_producer(touched_claims) if self.db.db_height > 1 else []
+        blocking = self.db.get_streams_and_channels_reposted_by_channel_hashes(self.db.blocking_channel_hashes)
+        filtering = self.db.get_streams_and_channels_reposted_by_channel_hashes(self.db.filtering_channel_hashes)
+        return claims, blocking, filtering
+
+    async def claim_producer(self, removed_claims: Set[bytes], claims: List[dict], sent_digests: Dict[str, bytes]):
         if self.db.db_height <= 1:
             return
 
-        for claim_hash in self.removed_claims_to_send_es:
-            yield 'delete', claim_hash.hex()
+        for claim_hash in removed_claims:
+            claim_id = claim_hash.hex()
+            self._es_doc_cache.pop(claim_id, None)
+            yield 'delete', claim_id
 
-        to_update = await asyncio.get_event_loop().run_in_executor(
-            self._sync_reader_executor, self.db.claims_producer, self.touched_claims_to_send_es
-        )
-        for claim in to_update:
+        for claim in claims:
+            digest = hashlib.sha256(repr(claim).encode()).digest()
+            if self._es_doc_cache.get(claim['claim_id']) == digest:
+                continue
+            sent_digests[claim['claim_id']] = digest
             yield 'update', claim
 
+    async def _send_claims_to_es(self, removed_claims: Set[bytes], claims: List[dict]):
+        sent_digests = {}
+        failed = await self.db.search_index.claim_consumer(
+            self.claim_producer(removed_claims, claims, sent_digests)
+        )
+        # only remember the documents ES accepted, anything else is sent again the next time it's touched
+        for claim_id, digest in sent_digests.items():
+            if claim_id not in failed:
+                self._es_doc_cache.set(claim_id, digest)
+
+    async def _es_worker(self):
+        """Apply the claim changes queued by check_and_advance_blocks to the search index.
+
+        This runs alongside block processing so that the next blocks can be advanced while ES is being updated,
+        the bounded queue keeps block processing from getting too far ahead of the search index.
+        """
+        while True:
+            height, removed_claims, claims, blocking, filtering, activation_info = await self._es_queue.get()
+            try:
+                self.db.blocked_streams, self.db.blocked_channels = blocking
+                self.db.filtered_streams, self.db.filtered_channels = filtering
+                await self._send_claims_to_es(removed_claims, claims)
+                await self.db.search_index.apply_filters(self.db.blocked_streams, self.db.blocked_channels,
+                                                         self.db.filtered_streams, self.db.filtered_channels)
+                await self.db.search_index.update_trending_score(activation_info)
+                self.db.search_index.clear_caches()
+                # persisted with the db state of the next block, or on shutdown
+                self.es_sync_height = height
+            except Exception:
+                self.logger.exception("updating the search index failed")
+                # unblock anything waiting on the queue, the error is raised by _check_es_worker
+                while not self._es_queue.empty():
+                    self._es_queue.get_nowait()
+                    self._es_queue.task_done()
+                raise
+            finally:
+                self._es_queue.task_done()
+
+    def _check_es_worker(self):
+        if self._es_task.done():
+            self._es_task.result()  # raise the error that stopped the worker
+
+    async def _wait_for_es_updates(self):
+        self._check_es_worker()
+        await self._es_queue.join()
+        self._check_es_worker()
+
+    async def _stop_es_worker(self):
+        """Send the queued claim changes to ES before stopping the worker, the snapshots in the queue can cover
+        several prefetched batches of blocks and would otherwise have to be synced from the db on the next start.
+        """
+        if not self._es_task:
+            return
+        try:
+            if not self._es_task.done():
+                await self._es_queue.join()
+        finally:
+            self._es_task.cancel()
+
+    async def _queue_es_update(self):
+        self._check_es_worker()
+        claims, blocking, filtering = await self.run_in_thread_with_lock(
+            self._read_es_update, self.touched_claims_to_send_es
+        )
+        await self._es_queue.put((
+            self.height, self.removed_claims_to_send_es, claims, blocking, filtering,
+            self.activation_info_to_send_es
+        ))
+        # the worker drains the queue when it fails, which would let a put waiting for room go through
+        self._check_es_worker()
+        self.removed_claims_to_send_es = set()
+        self.touched_claims_to_send_es = set()
+        self.activation_info_to_send_es = defaultdict(list)
+
     async def run_in_thread_with_lock(self, func, *args):
         # Run in a thread to prevent blocking.  Shielded so that
         # cancellations from shutdown don't lose work - when the task
@@ -326,6 +459,13 @@ class BlockProcessor:
             return await asyncio.get_event_loop().run_in_executor(self._chain_executor, func, *args)
         return await asyncio.shield(run_in_thread())
 
+    def _parse_blocks(self, raw_blocks, first: int):
+        blocks = [self.coin.block(raw_block, first + n) for n, raw_block in enumerate(raw_blocks)]
+        headers = [block.header for block in blocks]
+        hprevs = [self.coin.header_prevhash(h) for h in headers]
+        chain = [self.tip] + [self.coin.header_hash(h) for h in headers[:-1]]
+        return blocks, hprevs, chain
+
     async def check_and_advance_blocks(self, raw_blocks):
         """Process the list of raw blocks passed.  Detects and handles
         reorgs.
@@ -333,20 +473,17 @@ class BlockProcessor:
 
         if not raw_blocks:
             return
-        first = self.height + 1
-        blocks = [self.coin.block(raw_block, first + n)
-                  for n, raw_block in enumerate(raw_blocks)]
-        headers = [block.header for block in blocks]
-        hprevs = [self.coin.header_prevhash(h) for h in headers]
-        chain = [self.tip] + [self.coin.header_hash(h) for h in headers[:-1]]
+        # deserializing and hashing the blocks is cpu bound, do it in the block processor thread so the
+        # event loop can keep serving sessions while a batch of blocks is parsed
+        blocks, hprevs, chain = await self.run_in_thread(self._parse_blocks, raw_blocks, self.height + 1)
 
         if hprevs == chain:
             total_start = time.perf_counter()
             try:
                 for block in blocks:
                     start = time.perf_counter()
-                    await self.run_in_thread(self.advance_block, block)
-                    await self.flush()
+                    # advance and flush in a single trip to the block processor thread
+                    await self.run_in_thread_with_lock(self.advance_and_flush_block, block)
 
                     self.logger.info("advanced to %i in %0.3fs", self.height, time.perf_counter() - start)
                     if self.height == self.coin.nExtendedClaimExpirationForkHeight:
@@ -359,18 +496,16 @@ class BlockProcessor:
                         self.touched_claims_to_send_es.clear()
                         self.removed_claims_to_send_es.clear()
                         self.activation_info_to_send_es.clear()
-                # TODO: we shouldnt wait on the search index updating before advancing to the next block
                 if not self.db.first_sync:
-                    await self.db.reload_blocking_filtering_streams()
-                    await self.db.search_index.claim_consumer(self.claim_producer())
-                    await self.db.search_index.apply_filters(self.db.blocked_streams, self.db.blocked_channels,
-                                                                 self.db.filtered_streams, self.db.filtered_channels)
-                    await self.db.search_index.update_trending_score(self.activation_info_to_send_es)
-                    await self._es_caught_up()
-                self.db.search_index.clear_caches()
-                self.touched_claims_to_send_es.clear()
-                self.removed_claims_to_send_es.clear()
-                self.activation_info_to_send_es.clear()
+                    await self._queue_es_update()
+                    if self._caught_up_event.is_set():
+                        # sessions are notified of the new blocks below, their claims have to be searchable by then
+                        await self._wait_for_es_updates()
+                else:
+                    self.db.search_index.clear_caches()
+                    self.touched_claims_to_send_es.clear()
+                    self.removed_claims_to_send_es.clear()
+                    self.activation_info_to_send_es.clear()
                 # print("******************\n")
             except:
                 self.logger.exception("advance blocks failed")
@@ -398,6 +533,8 @@ class BlockProcessor:
                     break
                 count += 1
             self.logger.warning(f"blockchain reorg detected at {self.height}, unwinding last {count} blocks")
+            # let the search index catch up to the current chain before unwinding it
+            await self._wait_for_es_updates()
             try:
                 assert count > 0, count
                 for _ in range(count):
@@ -410,11 +547,15 @@ class BlockProcessor:
                         if not self.db.get_claim_txo(touched):
                             self.removed_claims_to_send_es.add(touched)
                     self.touched_claims_to_send_es.difference_update(self.removed_claims_to_send_es)
-                    await self.db.search_index.claim_consumer(self.claim_producer())
+                    claims = await self.run_in_thread_with_lock(
+                        self.db.claims_producer, self.touched_claims_to_send_es
+                    )
+                    await self._send_claims_to_es(self.removed_claims_to_send_es, claims)
                     self.db.search_index.clear_caches()
                     self.touched_claims_to_send_es.clear()
                     self.removed_claims_to_send_es.clear()
                     self.activation_info_to_send_es.clear()
+                self.es_sync_height = self.height
                 await self.prefetcher.reset_height(self.height)
                 self.reorg_count_metric.inc()
             except:
@@ -432,31 +573,73 @@ class BlockProcessor:
                                 'resetting the prefetcher')
             await self.prefetcher.reset_height(self.height)
 
-    async def flush(self):
+    def flush(self):
         save_undo = (self.daemon.cached_height() - self.height) <= self.env.reorg_limit
+        # the db state was already staged at the end of advance_block, staging it again here
+        # would only add a redundant delete/put pair to the batch
+        if save_undo:
+            self.db.prefix_db.commit(self.height)
+        else:
+            self.db.prefix_db.unsafe_commit()
+        self.clear_after_advance_or_reorg()
+        self.db.assert_db_state()
 
-        def flush():
-            self.db.write_db_state()
-            if save_undo:
-                self.db.prefix_db.commit(self.height)
-            else:
-                self.db.prefix_db.unsafe_commit()
-            self.clear_after_advance_or_reorg()
-            self.db.assert_db_state()
-        await self.run_in_thread_with_lock(flush)
+    def advance_and_flush_block(self, block):
+        self.advance_block(block)
+        self.flush()
+
+    def _get_claim_txo(self, claim_hash: bytes) -> Optional[ClaimToTXOValue]:
+        # the db isn't written to until the block is flushed, so committed reads can be reused for the whole block
+        if claim_hash in self.claim_txo_cache:
+            return self.claim_txo_cache[claim_hash]
+        self.claim_txo_cache[claim_hash] = claim_txo = self.db.get_claim_txo(claim_hash)
+        return claim_txo
+
+    def _prefetch_claim_txos(self, claim_hashes: typing.Iterable[bytes]):
+        """Read the claim txos not yet in claim_txo_cache for the given claims in one batch"""
+        claim_hashes = [claim_hash for claim_hash in claim_hashes if claim_hash not in self.claim_txo_cache]
+        claim_txos = self.db.prefix_db.claim_to_txo.multi_get([(claim_hash,) for claim_hash in claim_hashes])
+        self.claim_txo_cache.update(zip(claim_hashes, claim_txos))
+
+    def _prefetch_signing_channels(self, txos_by_tx: List[Optional[List['Output']]]):
+        """Read the claim txos of the channels signing claims in the block in one batch"""
+        channel_hashes = set()
+        for txos in txos_by_tx:
+            if not txos:
+                continue
+            for txo in txos:
+                if not txo.is_claim:
+                    continue
+                try:
+                    claim = txo.claim
+                    if claim.is_signed and claim.signing_channel_hash:
+                        channel_hashes.add(claim.signing_channel_hash[::-1])
+                except:  # invalid claims are handled in _add_claim_or_update
+                    continue
+        self._prefetch_claim_txos(
+            claim_hash for claim_hash in channel_hashes if claim_hash not in self.channel_pub_key_cache
+        )
+
+    def _is_channel_signature_valid(self, signature: bytes, digest: bytes, public_key_bytes: bytes) -> bool:
+        public_key = self.channel_verifying_key_cache.get(public_key_bytes)
+        if public_key is None:
+            public_key = PublicKey.from_compressed(public_key_bytes)
+            self.channel_verifying_key_cache.set(public_key_bytes, public_key)
+        return public_key.verify(signature, digest)
 
     def _add_claim_or_update(self, height: int, txo: 'Output', tx_hash: bytes, tx_num: int, nout: int,
                              spent_claims: typing.Dict[bytes, typing.Tuple[int, int, str]]):
+        script = txo.script
+        is_claim_name = script.is_claim_name
+        raw_claim_name = script.values['claim_name']
         try:
-            claim_name = txo.script.values['claim_name'].decode()
-        except UnicodeDecodeError:
-            claim_name = ''.join(chr(c) for c in txo.script.values['claim_name'])
-        try:
-            normalized_name = txo.normalized_name
+            claim_name = raw_claim_name.decode()
         except UnicodeDecodeError:
-            normalized_name = claim_name
-        if txo.script.is_claim_name:
-            claim_hash = hash160(tx_hash + pack('>I', nout))[::-1]
+            claim_name = normalized_name = intern(''.join(chr(c) for c in raw_claim_name))
+        else:
+            normalized_name = intern(normalize_name(claim_name))
+        if is_claim_name:
+            claim_hash = hash160(tx_hash + NOUT_STRUCT.pack(nout))[::-1]
             # print(f"\tnew {claim_hash.hex()} ({tx_num} {txo.amount})")
         else:
             claim_hash = txo.claim_hash[::-1]
@@ -465,58 +648,60 @@ class BlockProcessor:
         signing_channel_hash = None
         channel_signature_is_valid = False
         try:
-            signable = txo.signable
-            is_repost = txo.claim.is_repost
-            is_channel = txo.claim.is_channel
-            if txo.claim.is_signed:
-                signing_channel_hash = txo.signable.signing_channel_hash[::-1]
+            claim = signable = txo.claim
+            is_repost = claim.is_repost
+            is_channel = claim.is_channel
+            if claim.is_signed:
+                signing_channel_hash = signable.signing_channel_hash[::-1]
         except:  # google.protobuf.message.DecodeError: Could not parse JSON.
-            signable = None
+            claim = signable = None
             is_repost = False
             is_channel = False
 
         reposted_claim_hash = None
 
         if is_repost:
-            reposted_claim_hash = txo.claim.repost.reference.claim_hash[::-1]
+            reposted_claim_hash = claim.repost.reference.claim_hash[::-1]
             self.pending_reposted.add(reposted_claim_hash)
 
         if is_channel:
-            self.pending_channels[claim_hash] = txo.claim.channel.public_key_bytes
+            self.pending_channels[claim_hash] = claim.channel.public_key_bytes
 
-        self.doesnt_have_valid_signature.add(claim_hash)
         raw_channel_tx = None
         if signable and signable.signing_channel_hash:
-            signing_channel = self.db.get_claim_txo(signing_channel_hash)
-
-            if signing_channel:
-                raw_channel_tx = self.db.prefix_db.tx.get(
-                    self.db.get_tx_hash(signing_channel.tx_num), deserialize_value=False
-                )
-            channel_pub_key_bytes = None
+            channel_pub_key_bytes = self.channel_pub_key_cache.get(signing_channel_hash)
+            signing_channel = None
+            if channel_pub_key_bytes is None:
+                signing_channel = self._get_claim_txo(signing_channel_hash)
+                if signing_channel:
+                    raw_channel_tx = self.db.prefix_db.tx.get(
+                        self.db.get_tx_hash(signing_channel.tx_num), deserialize_value=False
+                    )
             try:
-                if not signing_channel:
-                    if txo.signable.signing_channel_hash[::-1] in self.pending_channels:
-                        channel_pub_key_bytes = self.pending_channels[signing_channel_hash]
-                elif raw_channel_tx:
-                    chan_output = self.coin.transaction(raw_channel_tx).outputs[signing_channel.position]
-                    chan_script = OutputScript(chan_output.pk_script)
-                    chan_script.parse()
-                    channel_meta = Claim.from_bytes(chan_script.values['claim'])
-
-                    channel_pub_key_bytes = channel_meta.channel.public_key_bytes
+                if channel_pub_key_bytes is None:
+                    if not signing_channel:
+                        channel_pub_key_bytes = self.pending_channels.get(signing_channel_hash)
+                    elif raw_channel_tx:
+                        chan_output = self.coin.transaction(raw_channel_tx).outputs[signing_channel.position]
+                        chan_script = OutputScript(chan_output.pk_script)
+                        chan_script.parse()
+                        channel_meta = Claim.from_bytes(chan_script.values['claim'])
+
+                        channel_pub_key_bytes = channel_meta.channel.public_key_bytes
+                        self.channel_pub_key_cache.set(signing_channel_hash, channel_pub_key_bytes)
                 if channel_pub_key_bytes:
-                    channel_signature_is_valid = Output.is_signature_valid(
-                        txo.signable.signature, txo.get_signature_digest(self.ledger), channel_pub_key_bytes
+                    channel_signature_is_valid = self._is_channel_signature_valid(
+                        signable.signature, txo.get_signature_digest(self.ledger), channel_pub_key_bytes
                     )
                     if channel_signature_is_valid:
                         self.pending_channel_counts[signing_channel_hash] += 1
-                        self.doesnt_have_valid_signature.remove(claim_hash)
                         self.claim_channels[claim_hash] = signing_channel_hash
             except:
                 self.logger.exception(f"error validating channel signature for %s:%i", tx_hash[::-1].hex(), nout)
+        if not channel_signature_is_valid:
+            self.doesnt_have_valid_signature.add(claim_hash)
 
-        if txo.script.is_claim_name:  # it's a root claim
+        if is_claim_name:  # it's a root claim
             root_tx_num, root_idx = tx_num, nout
             previous_amount = 0
         else:  # it's a claim update
@@ -530,8 +715,8 @@ class BlockProcessor:
                 return
             (prev_tx_num, prev_idx, _) = spent_claims.pop(claim_hash)
             # print(f"\tupdate {claim_hash.hex()} {tx_hash[::-1].hex()} {txo.amount}")
-            if (prev_tx_num, prev_idx) in self.txo_to_claim:
-                previous_claim = self.txo_to_claim.pop((prev_tx_num, prev_idx))
+            if txo_key(prev_tx_num, prev_idx) in self.txo_to_claim:
+                previous_claim = self.txo_to_claim.pop(txo_key(prev_tx_num, prev_idx))
                 self.claim_hash_to_txo.pop(claim_hash)
                 root_tx_num, root_idx = previous_claim.root_tx_num, previous_claim.root_position
             else:
@@ -556,8 +741,10 @@ class BlockProcessor:
             claim_name, normalized_name, claim_hash, txo.amount, self.coin.get_expiration_height(height), tx_num, nout,
             root_tx_num, root_idx, channel_signature_is_valid, signing_channel_hash, reposted_claim_hash
         )
-        self.txo_to_claim[(tx_num, nout)] = pending
-        self.claim_hash_to_txo[claim_hash] = (tx_num, nout)
+        self.txo_to_claim[txo_key(tx_num, nout)] = pending
+        self.claim_hash_to_txo[claim_hash] = txo_key(tx_num, nout)
+        if channel_signature_is_valid:
+            self.pending_signed_claims_by_channel[signing_channel_hash][claim_hash] = None
         self.get_add_claim_utxo_ops(pending)
 
     def get_add_claim_utxo_ops(self, pending: StagedClaimtrieItem):
@@ -578,12 +765,10 @@ class BlockProcessor:
         )
 
         # short url resolution
-        for prefix_len in range(10):
-            self.db.prefix_db.claim_short_id.stage_put(
-                (pending.normalized_name, pending.claim_hash.hex()[:prefix_len + 1],
-                 pending.root_tx_num, pending.root_position),
-                (pending.tx_num, pending.position)
-            )
+        self.db.prefix_db.claim_short_id.stage_short_ids_put(
+            pending.normalized_name, pending.claim_hash.hex(), pending.root_tx_num, pending.root_position,
+            pending.tx_num, pending.position
+        )
 
         if pending.signing_hash and pending.channel_signature_is_valid:
             # channel by stream
@@ -620,12 +805,10 @@ class BlockProcessor:
         )
 
         # short url resolution
-        for prefix_len in range(10):
-            self.db.prefix_db.claim_short_id.stage_delete(
-                (pending.normalized_name, pending.claim_hash.hex()[:prefix_len + 1],
-                 pending.root_tx_num, pending.root_position),
-                (pending.tx_num, pending.position)
-            )
+        self.db.prefix_db.claim_short_id.stage_short_ids_delete(
+            pending.normalized_name, pending.claim_hash.hex(), pending.root_tx_num, pending.root_position,
+            pending.tx_num, pending.position
+        )
 
         if pending.signing_hash and pending.channel_signature_is_valid:
             # channel by stream
@@ -646,8 +829,9 @@ class BlockProcessor:
 
     def _add_support(self, height: int, txo: 'Output', tx_num: int, nout: int):
         supported_claim_hash = txo.claim_hash[::-1]
-        self.support_txos_by_claim[supported_claim_hash].append((tx_num, nout))
-        self.support_txo_to_claim[(tx_num, nout)] = supported_claim_hash, txo.amount
+        support_txo = txo_key(tx_num, nout)
+        self.support_txos_by_claim[supported_claim_hash].append(support_txo)
+        self.support_txo_to_claim[support_txo] = supported_claim_hash, txo.amount
         # print(f"\tsupport claim {supported_claim_hash.hex()} +{txo.amount}")
 
         self.db.prefix_db.claim_to_support.stage_put((supported_claim_hash, tx_num, nout), (txo.amount,))
@@ -664,22 +848,26 @@ class BlockProcessor:
     def _spend_support_txo(self, height: int, txin: TxInput):
         txin_num = self.get_pending_tx_num(txin.prev_hash)
         activation = 0
-        if (txin_num, txin.prev_idx) in self.support_txo_to_claim:
-            spent_support, support_amount = self.support_txo_to_claim.pop((txin_num, txin.prev_idx))
-            self.support_txos_by_claim[spent_support].remove((txin_num, txin.prev_idx))
+        spent_txo = txo_key(txin_num, txin.prev_idx)
+        if spent_txo in self.support_txo_to_claim:
+            spent_support, support_amount = self.support_txo_to_claim.pop(spent_txo)
+            self.support_txos_by_claim[spent_support].remove(spent_txo)
             supported_name = self._get_pending_claim_name(spent_support)
-            self.removed_support_txos_by_name_by_claim[supported_name][spent_support].append((txin_num, txin.prev_idx))
+            self.removed_support_txos_by_name_by_claim.setdefault((supported_name, spent_support), set()).add(
+                spent_txo
+            )
         else:
             spent_support, support_amount = self.db.get_supported_claim_from_txo(txin_num, txin.prev_idx)
             if not spent_support:  # it is not a support
                 return
             supported_name = self._get_pending_claim_name(spent_support)
             if supported_name is not None:
-                self.removed_support_txos_by_name_by_claim[supported_name][spent_support].append(
-                    (txin_num, txin.prev_idx))
+                self.removed_support_txos_by_name_by_claim.setdefault((supported_name, spent_support), set()).add(
+                    spent_txo
+                )
             activation = self.db.get_activation(txin_num, txin.prev_idx, is_support=True)
             if 0 < activation < self.height + 1:
-                self.removed_active_support_amount_by_claim[spent_support].append(support_amount)
+                self.removed_active_support_amount_by_claim[spent_support] += support_amount
             if supported_name is not None and activation > 0:
                 self.get_remove_activate_ops(
                     ACTIVATED_SUPPORT_TXO_TYPE, spent_support, txin_num, txin.prev_idx, activation, supported_name,
@@ -692,9 +880,8 @@ class BlockProcessor:
 
     def _spend_claim_txo(self, txin: TxInput, spent_claims: Dict[bytes, Tuple[int, int, str]]) -> bool:
         txin_num = self.get_pending_tx_num(txin.prev_hash)
-        if (txin_num, txin.prev_idx) in self.txo_to_claim:
-            spent = self.txo_to_claim[(txin_num, txin.prev_idx)]
-        else:
+        spent = self.txo_to_claim.get(txo_key(txin_num, txin.prev_idx))
+        if spent is None:
             if not self.db.get_cached_claim_exists(txin_num, txin.prev_idx):
                 # txo is not a claim
                 return False
@@ -723,8 +910,8 @@ class BlockProcessor:
             self._spend_support_txo(height, txin)
 
     def _abandon_claim(self, claim_hash: bytes, tx_num: int, nout: int, normalized_name: str):
-        if (tx_num, nout) in self.txo_to_claim:
-            pending = self.txo_to_claim.pop((tx_num, nout))
+        pending = self.txo_to_claim.pop(txo_key(tx_num, nout), None)
+        if pending is not None:
             self.claim_hash_to_txo.pop(claim_hash)
             self.abandoned_claims[pending.claim_hash] = pending
             claim_root_tx_num, claim_root_idx = pending.root_tx_num, pending.root_position
@@ -733,24 +920,21 @@ class BlockProcessor:
             expiration = self.coin.get_expiration_height(self.height)
             signature_is_valid = pending.channel_signature_is_valid
         else:
-            v = self.db.get_claim_txo(
+            v = self._get_claim_txo(
                 claim_hash
             )
             claim_root_tx_num, claim_root_idx, prev_amount = v.root_tx_num,  v.root_position, v.amount
             signature_is_valid, name = v.channel_signature_is_valid, v.name
             prev_signing_hash = self.db.get_channel_for_claim(claim_hash, tx_num, nout)
             reposted_claim_hash = self.db.get_repost(claim_hash)
-            expiration = self.coin.get_expiration_height(bisect_right(self.db.tx_counts, tx_num))
+            expiration = self.coin.get_expiration_height(self._get_height_for_tx_num(tx_num))
         self.abandoned_claims[claim_hash] = staged = StagedClaimtrieItem(
             name, normalized_name, claim_hash, prev_amount, expiration, tx_num, nout, claim_root_tx_num,
             claim_root_idx, signature_is_valid, prev_signing_hash, reposted_claim_hash
         )
-        for support_txo_to_clear in self.support_txos_by_claim[claim_hash]:
+        for support_txo_to_clear in self.support_txos_by_claim.pop(claim_hash, ()):
             self.support_txo_to_claim.pop(support_txo_to_clear)
-        self.support_txos_by_claim[claim_hash].clear()
-        self.support_txos_by_claim.pop(claim_hash)
-        if claim_hash.hex() in self.activation_info_to_send_es:
-            self.activation_info_to_send_es.pop(claim_hash.hex())
+        self.activation_info_to_send_es.pop(claim_hash, None)
         if normalized_name.startswith('@'):  # abandon a channel, invalidate signatures
             self._invalidate_channel_signatures(claim_hash)
 
@@ -777,15 +961,21 @@ class BlockProcessor:
             )
 
     def _invalidate_channel_signatures(self, claim_hash: bytes):
+        abandoned_claims, expired_claim_hashes = self.abandoned_claims, self.expired_claim_hashes
+        doesnt_have_valid_signature, claim_channels = self.doesnt_have_valid_signature, self.claim_channels
+        signatures_changed = self.signatures_changed
         for (signed_claim_hash, ) in self.db.prefix_db.channel_to_claim.iterate(
                 prefix=(claim_hash, ), include_key=False):
-            if signed_claim_hash in self.abandoned_claims or signed_claim_hash in self.expired_claim_hashes:
+            if signed_claim_hash in abandoned_claims or signed_claim_hash in expired_claim_hashes:
                 continue
             # there is no longer a signing channel for this claim as of this block
-            if signed_claim_hash in self.doesnt_have_valid_signature:
+            if signed_claim_hash in doesnt_have_valid_signature:
+                continue
+            # the signature was already invalidated in this block
+            if signed_claim_hash in signatures_changed:
                 continue
             # the signing channel changed in this block
-            if signed_claim_hash in self.claim_channels and signed_claim_hash != self.claim_channels[signed_claim_hash]:
+            if signed_claim_hash in claim_channels and signed_claim_hash != claim_channels[signed_claim_hash]:
                 continue
 
             # if the claim with an invalidated signature is in this block, update the StagedClaimtrieItem
@@ -802,25 +992,35 @@ class BlockProcessor:
             self.pending_channel_counts[claim_hash] -= 1
             self._get_invalidate_signature_ops(claim)
 
-        for staged in list(self.txo_to_claim.values()):
-            needs_invalidate = staged.claim_hash not in self.doesnt_have_valid_signature
-            if staged.signing_hash == claim_hash and needs_invalidate:
+        for signed_claim_hash in self.pending_signed_claims_by_channel.get(claim_hash, ()):
+            if signed_claim_hash not in self.claim_hash_to_txo:  # spent later in the block
+                continue
+            signed_claim_txo = self.claim_hash_to_txo[signed_claim_hash]
+            staged = self.txo_to_claim[signed_claim_txo]
+            if staged.signing_hash == claim_hash and staged.channel_signature_is_valid:
                 self._get_invalidate_signature_ops(staged)
-                self.txo_to_claim[self.claim_hash_to_txo[staged.claim_hash]] = staged.invalidate_signature()
+                self.txo_to_claim[signed_claim_txo] = staged.invalidate_signature()
                 self.signatures_changed.add(staged.claim_hash)
                 self.pending_channel_counts[claim_hash] -= 1
 
+    def _get_height_for_tx_num(self, tx_num: int) -> int:
+        tx_counts = self.db.tx_counts
+        # most claims being spent or abandoned are recent, skip the bisect for ones at or after the last block
+        if tx_counts and tx_num >= tx_counts[-1]:
+            return len(tx_counts)
+        return bisect_right(tx_counts, tx_num)
+
     def _make_pending_claim_txo(self, claim_hash: bytes):
-        claim = self.db.get_claim_txo(claim_hash)
+        claim = self._get_claim_txo(claim_hash)
         if claim_hash in self.doesnt_have_valid_signature:
             signing_hash = None
         else:
             signing_hash = self.db.get_channel_for_claim(claim_hash, claim.tx_num, claim.position)
         reposted_claim_hash = self.db.get_repost(claim_hash)
         return StagedClaimtrieItem(
-            claim.name, claim.normalized_name, claim_hash, claim.amount,
+            claim.name, intern(claim.normalized_name), claim_hash, claim.amount,
             self.coin.get_expiration_height(
-                bisect_right(self.db.tx_counts, claim.tx_num),
+                self._get_height_for_tx_num(claim.tx_num),
                 extended=self.height >= self.coin.nExtendedClaimExpirationForkHeight
             ),
             claim.tx_num, claim.position, claim.root_tx_num, claim.root_position,
@@ -829,18 +1029,16 @@ class BlockProcessor:
 
     def _expire_claims(self, height: int):
         expired = self.db.get_expired_by_height(height)
-        self.expired_claim_hashes.update(set(expired.keys()))
+        self.expired_claim_hashes.update(expired)
         spent_claims = {}
         for expired_claim_hash, (tx_num, position, name, txi) in expired.items():
-            if (tx_num, position) not in self.txo_to_claim:
+            if txo_key(tx_num, position) not in self.txo_to_claim:
                 self._spend_claim_txo(txi, spent_claims)
         if expired:
             # abandon the channels last to handle abandoned signed claims in the same tx,
             # see test_abandon_channel_and_claims_in_same_tx
             expired_channels = {}
             for abandoned_claim_hash, (tx_num, nout, normalized_name) in spent_claims.items():
-                self._abandon_claim(abandoned_claim_hash, tx_num, nout, normalized_name)
-
                 if normalized_name.startswith('@'):
                     expired_channels[abandoned_claim_hash] = (tx_num, nout, normalized_name)
                 else:
@@ -879,71 +1077,106 @@ class BlockProcessor:
         return self._cached_get_active_amount(claim_hash, ACTIVATED_CLAIM_TXO_TYPE, height or (self.height + 1))
 
     def _get_pending_claim_name(self, claim_hash: bytes) -> Optional[str]:
-        assert claim_hash is not None
         if claim_hash in self.claim_hash_to_txo:
             return self.txo_to_claim[self.claim_hash_to_txo[claim_hash]].normalized_name
-        claim_info = self.db.get_claim_txo(claim_hash)
+        claim_info = self._get_claim_txo(claim_hash)
         if claim_info:
-            return claim_info.normalized_name
+            return intern(claim_info.normalized_name)
 
     def _get_pending_supported_amount(self, claim_hash: bytes, height: Optional[int] = None) -> int:
         amount = self._cached_get_active_amount(claim_hash, ACTIVATED_SUPPORT_TXO_TYPE, height or (self.height + 1))
-        if claim_hash in self.activated_support_amount_by_claim:
-            amount += sum(self.activated_support_amount_by_claim[claim_hash])
-        if claim_hash in self.possible_future_support_amounts_by_claim_hash:
-            amount += sum(self.possible_future_support_amounts_by_claim_hash[claim_hash])
-        if claim_hash in self.removed_active_support_amount_by_claim:
-            return amount - sum(self.removed_active_support_amount_by_claim[claim_hash])
-        return amount
+        # these are defaultdicts, use .get so that looking up a claim doesn't add it
+        return amount + self.activated_support_amount_by_claim.get(claim_hash, 0) + \
+            self.possible_future_support_amounts_by_claim_hash.get(claim_hash, 0) - \
+            self.removed_active_support_amount_by_claim.get(claim_hash, 0)
 
     def _get_pending_effective_amount(self, name: str, claim_hash: bytes, height: Optional[int] = None) -> int:
         claim_amount = self._get_pending_claim_amount(name, claim_hash, height=height)
         support_amount = self._get_pending_supported_amount(claim_hash, height=height)
         return claim_amount + support_amount
 
+    def _get_final_pending_effective_amount(self, name: str, claim_hash: bytes, height: Optional[int] = None) -> int:
+        # only use this once all of the block's pending activations are known (from the takeover pass onwards),
+        # after that point the pending amounts no longer change and the result can be reused for the block
+        key = (name, claim_hash, height)
+        if key in self.effective_amount_cache:
+            return self.effective_amount_cache[key]
+        self.effective_amount_cache[key] = amount = self._get_pending_effective_amount(name, claim_hash, height)
+        return amount
+
+    def _get_claims_for_name(self, name: str) -> List[bytes]:
+        # the db is only written when the block is flushed, so the claims for a name are fixed for the block
+        claims = self.claims_for_name_cache.get(name)
+        if claims is None:
+            claims = self.claims_for_name_cache[name] = self.db.get_claims_for_name(name)
+        return claims
+
     def get_activate_ops(self, txo_type: int, claim_hash: bytes, tx_num: int, position: int,
                           activation_height: int, name: str, amount: int):
-        self.db.prefix_db.activated.stage_put(
-            (txo_type, tx_num, position), (activation_height, claim_hash, name)
-        )
-        self.db.prefix_db.pending_activation.stage_put(
-            (activation_height, txo_type, tx_num, position), (claim_hash, name)
-        )
-        self.db.prefix_db.active_amount.stage_put(
-            (claim_hash, txo_type, activation_height, tx_num, position), (amount,)
-        )
+        prefix_db = self.db.prefix_db
+        prefix_db.stage_raw_ops((
+            RevertablePut(*prefix_db.activated.pack_item(
+                txo_type, tx_num, position, activation_height, claim_hash, name
+            )),
+            RevertablePut(*prefix_db.pending_activation.pack_item(
+                activation_height, txo_type, tx_num, position, claim_hash, name
+            )),
+            RevertablePut(*prefix_db.active_amount.pack_item(
+                claim_hash, txo_type, activation_height, tx_num, position, amount
+            ))
+        ))
 
     def get_remove_activate_ops(self, txo_type: int, claim_hash: bytes, tx_num: int, position: int,
                                 activation_height: int, name: str, amount: int):
-        self.db.prefix_db.activated.stage_delete(
-            (txo_type, tx_num, position), (activation_height, claim_hash, name)
-        )
-        self.db.prefix_db.pending_activation.stage_delete(
-            (activation_height, txo_type, tx_num, position), (claim_hash, name)
-        )
-        self.db.prefix_db.active_amount.stage_delete(
-            (claim_hash, txo_type, activation_height, tx_num, position), (amount,)
-        )
+        prefix_db = self.db.prefix_db
+        prefix_db.stage_raw_ops((
+            RevertableDelete(*prefix_db.activated.pack_item(
+                txo_type, tx_num, position, activation_height, claim_hash, name
+            )),
+            RevertableDelete(*prefix_db.pending_activation.pack_item(
+                activation_height, txo_type, tx_num, position, claim_hash, name
+            )),
+            RevertableDelete(*prefix_db.active_amount.pack_item(
+                claim_hash, txo_type, activation_height, tx_num, position, amount
+            ))
+        ))
 
     def _get_takeover_ops(self, height: int):
+        abandoned_claims = self.abandoned_claims
+        claim_hash_to_txo = self.claim_hash_to_txo
+        txo_to_claim = self.txo_to_claim
 
         # cache for controlling claims as of the previous block
         controlling_claims = {}
 
         def get_controlling(_name):
             if _name not in controlling_claims:
-                _controlling = self.db.get_controlling_claim(_name)
+                if _name in self.controlling_claim_cache:
+                    _controlling = self.controlling_claim_cache.get(_name)
+                else:
+                    _controlling = self.db.get_controlling_claim(_name)
+                    self.controlling_claim_cache.set(_name, _controlling)
                 controlling_claims[_name] = _controlling
             else:
                 _controlling = controlling_claims[_name]
             return _controlling
 
-        names_with_abandoned_or_updated_controlling_claims: List[str] = []
+        # insertion ordered rather than a set, str hashes are salted per process and iterating a set would stage
+        # the takeover ops in a different order on every run
+        names_with_abandoned_or_updated_controlling_claims: Dict[str, None] = {}
 
         # get the claims and supports previously scheduled to be activated at this block
         activated_at_height = self.db.get_activated_at_height(height)
-        activate_in_future = defaultdict(lambda: defaultdict(list))
-        future_activations = defaultdict(dict)
+        if not activated_at_height and not txo_to_claim and not self.support_txo_to_claim and \
+                not abandoned_claims and not self.updated_claims and \
+                not self.removed_active_support_amount_by_claim and not self.pending_support_amount_change:
+            # nothing in this block can activate a claim or support, or trigger a takeover
+            return
+        # {(name, claim_hash): [(PendingActivationKey, amount), ...]}
+        activate_in_future: Dict[Tuple[str, bytes], List[Tuple[PendingActivationKey, int]]] = {}
+        # {(name, claim_hash, tx_num, position): activation height} for the txos in activate_in_future
+        future_activation_heights: Dict[Tuple[str, bytes, int, int], int] = {}
+        future_activations: Dict[str, Dict[bytes, Tuple[int, PendingActivationValue, PendingActivationKey]]] = {}
 
         def get_delayed_activate_ops(name: str, claim_hash: bytes, is_new_claim: bool, tx_num: int, nout: int,
                                      amount: int, is_support: bool):
@@ -971,12 +1204,13 @@ class BlockProcessor:
                     )
                 )
             else:  # if the delay was higher if still needs to be considered if something else triggers a takeover
-                activate_in_future[name][claim_hash].append((
+                activate_in_future.setdefault((name, claim_hash), []).append((
                     PendingActivationKey(
                         height + delay, ACTIVATED_SUPPORT_TXO_TYPE if is_support else ACTIVATED_CLAIM_TXO_TYPE,
                         tx_num, nout
                     ), amount
                 ))
+                future_activation_heights.setdefault((name, claim_hash, tx_num, nout), height + delay)
                 if is_support:
                     self.possible_future_support_txos_by_claim_hash[claim_hash].append((tx_num, nout))
             self.get_activate_ops(
@@ -986,10 +1220,10 @@ class BlockProcessor:
 
         # determine names needing takeover/deletion due to controlling claims being abandoned
         # and add ops to deactivate abandoned claims
-        for claim_hash, staged in self.abandoned_claims.items():
+        for claim_hash, staged in abandoned_claims.items():
             controlling = get_controlling(staged.normalized_name)
             if controlling and controlling.claim_hash == claim_hash:
-                names_with_abandoned_or_updated_controlling_claims.append(staged.normalized_name)
+                names_with_abandoned_or_updated_controlling_claims[staged.normalized_name] = None
                 # print(f"\t{staged.name} needs takeover")
             activation = self.db.get_activation(staged.tx_num, staged.position)
             if activation > 0:  #  db returns -1 for non-existent txos
@@ -1003,19 +1237,19 @@ class BlockProcessor:
                 pass
 
         # get the removed activated supports for controlling claims to determine if takeovers are possible
-        abandoned_support_check_need_takeover = defaultdict(list)
-        for claim_hash, amounts in self.removed_active_support_amount_by_claim.items():
+        abandoned_support_check_need_takeover = []
+        for claim_hash in self.removed_active_support_amount_by_claim:
             name = self._get_pending_claim_name(claim_hash)
             if name is None:
                 continue
             controlling = get_controlling(name)
             if controlling and controlling.claim_hash == claim_hash and \
                     name not in names_with_abandoned_or_updated_controlling_claims:
-                abandoned_support_check_need_takeover[(name, claim_hash)].extend(amounts)
+                abandoned_support_check_need_takeover.append((name, claim_hash))
 
         # get the controlling claims with updates to the claim to check if takeover is needed
         for claim_hash in self.updated_claims:
-            if claim_hash in self.abandoned_claims:
+            if claim_hash in abandoned_claims:
                 continue
             name = self._get_pending_claim_name(claim_hash)
             if name is None:
@@ -1023,10 +1257,10 @@ class BlockProcessor:
             controlling = get_controlling(name)
             if controlling and controlling.claim_hash == claim_hash and \
                     name not in names_with_abandoned_or_updated_controlling_claims:
-                names_with_abandoned_or_updated_controlling_claims.append(name)
+                names_with_abandoned_or_updated_controlling_claims[name] = None
 
         # prepare to activate or delay activation of the pending claims being added this block
-        for (tx_num, nout), staged in self.txo_to_claim.items():
+        for staged in txo_to_claim.values():
             is_delayed = not staged.is_update
             prev_txo = self.db.get_cached_claim_txo(staged.claim_hash)
             if prev_txo:
@@ -1034,19 +1268,19 @@ class BlockProcessor:
                 if height < prev_activation or prev_activation < 0:
                     is_delayed = True
             get_delayed_activate_ops(
-                staged.normalized_name, staged.claim_hash, is_delayed, tx_num, nout, staged.amount,
+                staged.normalized_name, staged.claim_hash, is_delayed, staged.tx_num, staged.position, staged.amount,
                 is_support=False
             )
 
         # and the supports
-        for (tx_num, nout), (claim_hash, amount) in self.support_txo_to_claim.items():
-            if claim_hash in self.abandoned_claims:
+        for support_txo, (claim_hash, amount) in self.support_txo_to_claim.items():
+            if claim_hash in abandoned_claims:
                 continue
-            elif claim_hash in self.claim_hash_to_txo:
-                name = self.txo_to_claim[self.claim_hash_to_txo[claim_hash]].normalized_name
-                staged_is_new_claim = not self.txo_to_claim[self.claim_hash_to_txo[claim_hash]].is_update
+            elif claim_hash in claim_hash_to_txo:
+                name = txo_to_claim[claim_hash_to_txo[claim_hash]].normalized_name
+                staged_is_new_claim = not txo_to_claim[claim_hash_to_txo[claim_hash]].is_update
             else:
-                supported_claim_info = self.db.get_claim_txo(claim_hash)
+                supported_claim_info = self._get_claim_txo(claim_hash)
                 if not supported_claim_info:
                     # the supported claim doesn't exist
                     continue
@@ -1054,6 +1288,7 @@ class BlockProcessor:
                     v = supported_claim_info
                 name = v.normalized_name
                 staged_is_new_claim = (v.root_tx_num, v.root_position) == (v.tx_num, v.position)
+            tx_num, nout = split_txo_key(support_txo)
             get_delayed_activate_ops(
                 name, claim_hash, staged_is_new_claim, tx_num, nout, amount, is_support=True
             )
@@ -1061,22 +1296,24 @@ class BlockProcessor:
         # add the activation/delayed-activation ops
         for activated, activated_txos in activated_at_height.items():
             controlling = get_controlling(activated.normalized_name)
-            if activated.claim_hash in self.abandoned_claims:
+            if activated.claim_hash in abandoned_claims:
                 continue
             reactivate = False
             if not controlling or controlling.claim_hash == activated.claim_hash:
                 # there is no delay for claims to a name without a controlling value or to the controlling value
                 reactivate = True
+            removed_support_txos = self.removed_support_txos_by_name_by_claim.get(
+                (activated.normalized_name, activated.claim_hash), ()
+            )
             for activated_txo in activated_txos:
-                if activated_txo.is_support and (activated_txo.tx_num, activated_txo.position) in \
-                        self.removed_support_txos_by_name_by_claim[activated.normalized_name][activated.claim_hash]:
+                activated_txo_key = txo_key(activated_txo.tx_num, activated_txo.position)
+                if activated_txo.is_support and activated_txo_key in removed_support_txos:
                     # print("\tskip activate support for pending abandoned claim")
                     continue
                 if activated_txo.is_claim:
                     txo_type = ACTIVATED_CLAIM_TXO_TYPE
-                    txo_tup = (activated_txo.tx_num, activated_txo.position)
-                    if txo_tup in self.txo_to_claim:
-                        amount = self.txo_to_claim[txo_tup].amount
+                    if activated_txo_key in txo_to_claim:
+                        amount = txo_to_claim[activated_txo_key].amount
                     else:
                         amount = self.db.get_claim_txo_amount(
                             activated.claim_hash
@@ -1087,9 +1324,8 @@ class BlockProcessor:
                     self.activated_claim_amount_by_name_and_hash[(activated.normalized_name, activated.claim_hash)] = amount
                 else:
                     txo_type = ACTIVATED_SUPPORT_TXO_TYPE
-                    txo_tup = (activated_txo.tx_num, activated_txo.position)
-                    if txo_tup in self.support_txo_to_claim:
-                        amount = self.support_txo_to_claim[txo_tup][1]
+                    if activated_txo_key in self.support_txo_to_claim:
+                        amount = self.support_txo_to_claim[activated_txo_key][1]
                     else:
                         amount = self.db.get_support_txo_amount(
                             activated.claim_hash, activated_txo.tx_num, activated_txo.position
@@ -1097,8 +1333,8 @@ class BlockProcessor:
                     if amount is None:
                         # print("\tskip activate support for non existent claim")
                         continue
-                    self.activated_support_amount_by_claim[activated.claim_hash].append(amount)
-                self.activation_by_claim_by_name[activated.normalized_name][activated.claim_hash].append((activated_txo, amount))
+                    self.activated_support_amount_by_claim[activated.claim_hash] += amount
+                self.activation_by_claim_by_name[activated.normalized_name][activated.claim_hash] = None
                 # print(f"\tactivate {'support' if txo_type == ACTIVATED_SUPPORT_TXO_TYPE else 'claim'} "
                 #       f"{activated.claim_hash.hex()} @ {activated_txo.height}")
 
@@ -1111,16 +1347,14 @@ class BlockProcessor:
             # add existing claims to the queue for the takeover
             # track that we need to reactivate these if one of them becomes controlling
             for candidate_claim_hash, (tx_num, nout) in existing.items():
-                if candidate_claim_hash in self.abandoned_claims:
+                if candidate_claim_hash in abandoned_claims:
                     continue
                 has_candidate = True
                 existing_activation = self.db.get_activation(tx_num, nout)
                 activate_key = PendingActivationKey(
                     existing_activation, ACTIVATED_CLAIM_TXO_TYPE, tx_num, nout
                 )
-                self.activation_by_claim_by_name[need_takeover][candidate_claim_hash].append((
-                    activate_key, self.db.get_claim_txo_amount(candidate_claim_hash)
-                ))
+                self.activation_by_claim_by_name[need_takeover][candidate_claim_hash] = None
                 need_reactivate_if_takes_over[(need_takeover, candidate_claim_hash)] = activate_key
                 # print(f"\tcandidate to takeover abandoned controlling claim for "
                 #       f"{activate_key.tx_num}:{activate_key.position} {activate_key.is_claim}")
@@ -1146,28 +1380,27 @@ class BlockProcessor:
                 activated.normalized_name, activated.claim_hash, activated_claim_txo.height + 1
             )
             if activated.claim_hash not in claim_exists:
-                claim_exists[activated.claim_hash] = activated.claim_hash in self.claim_hash_to_txo or (
-                        self.db.get_claim_txo(activated.claim_hash) is not None)
-            if claim_exists[activated.claim_hash] and activated.claim_hash not in self.abandoned_claims:
+                claim_exists[activated.claim_hash] = activated.claim_hash in claim_hash_to_txo or (
+                        self._get_claim_txo(activated.claim_hash) is not None)
+            if claim_exists[activated.claim_hash] and activated.claim_hash not in abandoned_claims:
                 v = future_amount, activated, activated_claim_txo
-                future_activations[activated.normalized_name][activated.claim_hash] = v
-
-        for name, future_activated in activate_in_future.items():
-            for claim_hash, activated in future_activated.items():
-                if claim_hash not in claim_exists:
-                    claim_exists[claim_hash] = claim_hash in self.claim_hash_to_txo or (
-                            self.db.get_claim_txo(claim_hash) is not None)
-                if not claim_exists[claim_hash]:
-                    continue
-                if claim_hash in self.abandoned_claims:
-                    continue
-                for txo in activated:
-                    v = txo[1], PendingActivationValue(claim_hash, name), txo[0]
-                    future_activations[name][claim_hash] = v
-                    if txo[0].is_claim:
-                        self.possible_future_claim_amount_by_name_and_hash[(name, claim_hash)] = txo[1]
-                    else:
-                        self.possible_future_support_amounts_by_claim_hash[claim_hash].append(txo[1])
+                future_activations.setdefault(activated.normalized_name, {})[activated.claim_hash] = v
+
+        for (name, claim_hash), activated in activate_in_future.items():
+            if claim_hash not in claim_exists:
+                claim_exists[claim_hash] = claim_hash in claim_hash_to_txo or (
+                        self._get_claim_txo(claim_hash) is not None)
+            if not claim_exists[claim_hash]:
+                continue
+            if claim_hash in abandoned_claims:
+                continue
+            for txo in activated:
+                v = txo[1], PendingActivationValue(claim_hash, name), txo[0]
+                future_activations.setdefault(name, {})[claim_hash] = v
+                if txo[0].is_claim:
+                    self.possible_future_claim_amount_by_name_and_hash[(name, claim_hash)] = txo[1]
+                else:
+                    self.possible_future_support_amounts_by_claim_hash[claim_hash] += txo[1]
 
         # process takeovers
         checked_names = set()
@@ -1175,27 +1408,29 @@ class BlockProcessor:
             checked_names.add(name)
             controlling = controlling_claims[name]
             amounts = {
-                claim_hash: self._get_pending_effective_amount(name, claim_hash)
-                for claim_hash in activated.keys() if claim_hash not in self.abandoned_claims
+                claim_hash: self._get_final_pending_effective_amount(name, claim_hash)
+                for claim_hash in activated.keys() if claim_hash not in abandoned_claims
             }
             # if there is a controlling claim include it in the amounts to ensure it remains the max
-            if controlling and controlling.claim_hash not in self.abandoned_claims:
-                amounts[controlling.claim_hash] = self._get_pending_effective_amount(name, controlling.claim_hash)
-            winning_claim_hash = max(amounts, key=lambda x: amounts[x])
+            if controlling and controlling.claim_hash not in abandoned_claims:
+                amounts[controlling.claim_hash] = self._get_final_pending_effective_amount(
+                    name, controlling.claim_hash
+                )
+            winning_claim_hash = max(amounts.items(), key=itemgetter(1))[0]
             if not controlling or (winning_claim_hash != controlling.claim_hash and
                                    name in names_with_abandoned_or_updated_controlling_claims) or \
                     ((winning_claim_hash != controlling.claim_hash) and (amounts[winning_claim_hash] > amounts[controlling.claim_hash])):
                 amounts_with_future_activations = {claim_hash: amount for claim_hash, amount in amounts.items()}
                 amounts_with_future_activations.update(
                     {
-                        claim_hash: self._get_pending_effective_amount(
+                        claim_hash: self._get_final_pending_effective_amount(
                             name, claim_hash, self.height + 1 + self.coin.maxTakeoverDelay
-                        ) for claim_hash in future_activations[name]
+                        ) for claim_hash in future_activations.get(name, ())
                     }
                 )
                 winning_including_future_activations = max(
-                    amounts_with_future_activations, key=lambda x: amounts_with_future_activations[x]
-                )
+                    amounts_with_future_activations.items(), key=itemgetter(1)
+                )[0]
                 future_winning_amount = amounts_with_future_activations[winning_including_future_activations]
 
                 if winning_claim_hash != winning_including_future_activations and \
@@ -1203,20 +1438,18 @@ class BlockProcessor:
                     # print(f"\ttakeover by {winning_claim_hash.hex()} triggered early activation and "
                     #       f"takeover by {winning_including_future_activations.hex()} at {height}")
                     # handle a pending activated claim jumping the takeover delay when another name takes over
-                    if winning_including_future_activations not in self.claim_hash_to_txo:
-                        claim = self.db.get_claim_txo(winning_including_future_activations)
+                    if winning_including_future_activations not in claim_hash_to_txo:
+                        claim = self._get_claim_txo(winning_including_future_activations)
                         tx_num = claim.tx_num
                         position = claim.position
                         amount = claim.amount
                         activation = self.db.get_activation(tx_num, position)
                     else:
-                        tx_num, position = self.claim_hash_to_txo[winning_including_future_activations]
-                        amount = self.txo_to_claim[(tx_num, position)].amount
-                        activation = None
-                        for (k, tx_amount) in activate_in_future[name][winning_including_future_activations]:
-                            if (k.tx_num, k.position) == (tx_num, position):
-                                activation = k.height
-                                break
+                        pending = txo_to_claim[claim_hash_to_txo[winning_including_future_activations]]
+                        tx_num, position, amount = pending.tx_num, pending.position, pending.amount
+                        activation = future_activation_heights.get(
+                            (name, winning_including_future_activations, tx_num, position)
+                        )
                         if activation is None:
                             # TODO: reproduce this in an integration test (block 604718)
                             _k = PendingActivationValue(winning_including_future_activations, name)
@@ -1236,7 +1469,7 @@ class BlockProcessor:
                         position, height, name, amount
                     )
 
-                    for (k, amount) in activate_in_future[name][winning_including_future_activations]:
+                    for (k, amount) in activate_in_future.get((name, winning_including_future_activations), ()):
                         txo = (k.tx_num, k.position)
                         if txo in self.possible_future_support_txos_by_claim_hash[winning_including_future_activations]:
                             self.get_remove_activate_ops(
@@ -1254,7 +1487,7 @@ class BlockProcessor:
                         )
                     self.db.prefix_db.claim_takeover.stage_put((name,), (winning_including_future_activations, height))
                     self.touched_claim_hashes.add(winning_including_future_activations)
-                    if controlling and controlling.claim_hash not in self.abandoned_claims:
+                    if controlling and controlling.claim_hash not in abandoned_claims:
                         self.touched_claim_hashes.add(controlling.claim_hash)
                 elif not controlling or (winning_claim_hash != controlling.claim_hash and
                                        name in names_with_abandoned_or_updated_controlling_claims) or \
@@ -1265,9 +1498,9 @@ class BlockProcessor:
                         amount = self.db.get_claim_txo_amount(
                             winning_claim_hash
                         )
-                        if winning_claim_hash in self.claim_hash_to_txo:
-                            tx_num, position = self.claim_hash_to_txo[winning_claim_hash]
-                            amount = self.txo_to_claim[(tx_num, position)].amount
+                        if winning_claim_hash in claim_hash_to_txo:
+                            pending = txo_to_claim[claim_hash_to_txo[winning_claim_hash]]
+                            tx_num, position, amount = pending.tx_num, pending.position, pending.amount
                         else:
                             tx_num, position = previous_pending_activate.tx_num, previous_pending_activate.position
                         if previous_pending_activate.height > height:
@@ -1287,7 +1520,7 @@ class BlockProcessor:
                             (name,), (controlling.claim_hash, controlling.height)
                         )
                     self.db.prefix_db.claim_takeover.stage_put((name,), (winning_claim_hash, height))
-                    if controlling and controlling.claim_hash not in self.abandoned_claims:
+                    if controlling and controlling.claim_hash not in abandoned_claims:
                         self.touched_claim_hashes.add(controlling.claim_hash)
                     self.touched_claim_hashes.add(winning_claim_hash)
                 elif winning_claim_hash == controlling.claim_hash:
@@ -1298,18 +1531,20 @@ class BlockProcessor:
                     pass
 
         # handle remaining takeovers from abandoned supports
-        for (name, claim_hash), amounts in abandoned_support_check_need_takeover.items():
+        for name, claim_hash in abandoned_support_check_need_takeover:
             if name in checked_names:
                 continue
             checked_names.add(name)
             controlling = get_controlling(name)
             amounts = {
-                claim_hash: self._get_pending_effective_amount(name, claim_hash)
-                for claim_hash in self.db.get_claims_for_name(name) if claim_hash not in self.abandoned_claims
+                claim_hash: self._get_final_pending_effective_amount(name, claim_hash)
+                for claim_hash in self._get_claims_for_name(name) if claim_hash not in abandoned_claims
             }
-            if controlling and controlling.claim_hash not in self.abandoned_claims:
-                amounts[controlling.claim_hash] = self._get_pending_effective_amount(name, controlling.claim_hash)
-            winning = max(amounts, key=lambda x: amounts[x])
+            if controlling and controlling.claim_hash not in abandoned_claims:
+                amounts[controlling.claim_hash] = self._get_final_pending_effective_amount(
+                    name, controlling.claim_hash
+                )
+            winning = max(amounts.items(), key=itemgetter(1))[0]
 
             if (controlling and winning != controlling.claim_hash) or (not controlling and winning):
                 self.taken_over_names.add(name)
@@ -1323,114 +1558,124 @@ class BlockProcessor:
                     self.touched_claim_hashes.add(controlling.claim_hash)
                 self.touched_claim_hashes.add(winning)
 
-    def _add_claim_activation_change_notification(self, claim_id: str, height: int, prev_amount: int,
+        # the takeover rows of these names may have changed, so their cached controlling claims can't be reused
+        for name in self.taken_over_names:
+            self.controlling_claim_cache.pop(name, None)
+        for name in names_with_abandoned_or_updated_controlling_claims:
+            self.controlling_claim_cache.pop(name, None)
+
+    def _add_claim_activation_change_notification(self, claim_hash: bytes, height: int, prev_amount: int,
                                                   new_amount: int):
-        self.activation_info_to_send_es[claim_id].append(TrendingNotification(height, prev_amount, new_amount))
+        self.activation_info_to_send_es[claim_hash].append(TrendingNotification(height, prev_amount, new_amount))
+
+    def _get_url_effective_amounts(self):
+        # the names the removed and touched claims are indexed under, for _get_cumulative_update_ops
+        claims = []
+        for removed in self.removed_claim_hashes:
+            removed_claim = self._get_claim_txo(removed)
+            if removed_claim:
+                claims.append((removed_claim.normalized_name, removed))
+        for touched in self.touched_claim_hashes:
+            if not self._get_claim_txo(touched):
+                continue
+            if touched in self.claim_hash_to_txo:
+                claims.append((self.txo_to_claim[self.claim_hash_to_txo[touched]].normalized_name, touched))
+            else:
+                claims.append((self._get_claim_txo(touched).normalized_name, touched))
+        return self.db.get_url_effective_amounts(claims)
 
     def _get_cumulative_update_ops(self, height: int):
+        prefix_db = self.db.prefix_db
         # update the last takeover height for names with takeovers
         for name in self.taken_over_names:
-            self.touched_claim_hashes.update(
-                {claim_hash for claim_hash in self.db.get_claims_for_name(name)
-                 if claim_hash not in self.abandoned_claims}
-            )
+            self.touched_claim_hashes.update(self._get_claims_for_name(name))
 
         # gather cumulative removed/touched sets to update the search index
-        self.removed_claim_hashes.update(set(self.abandoned_claims.keys()))
+        self.removed_claim_hashes.update(self.abandoned_claims.keys())
+        self.touched_claim_hashes.update(chain(
+            map(itemgetter(1), self.activated_claim_amount_by_name_and_hash.keys()),
+            self.claim_hash_to_txo.keys(),
+            self.signatures_changed,
+            self.removed_active_support_amount_by_claim.keys(),
+            self.activated_support_amount_by_claim.keys(),
+            self.pending_support_amount_change.keys()
+        ))
         self.touched_claim_hashes.difference_update(self.removed_claim_hashes)
-        self.touched_claim_hashes.update(
-            set(
-                map(lambda item: item[1], self.activated_claim_amount_by_name_and_hash.keys())
-            ).union(
-                set(self.claim_hash_to_txo.keys())
-            ).union(
-                self.removed_active_support_amount_by_claim.keys()
-            ).union(
-                self.signatures_changed
-            ).union(
-                set(self.removed_active_support_amount_by_claim.keys())
-            ).union(
-                set(self.activated_support_amount_by_claim.keys())
-            ).union(
-                set(self.pending_support_amount_change.keys())
-            ).difference(
-                self.removed_claim_hashes
-            )
-        )
+        if not self.touched_claim_hashes and not self.removed_claim_hashes and \
+                not self.pending_support_amount_change and not self.pending_channel_counts and \
+                not self.pending_reposted:
+            # no claim changed in this block
+            return
 
         # update support amount totals
-        for supported_claim, amount in self.pending_support_amount_change.items():
-            existing = self.db.prefix_db.support_amount.get(supported_claim)
-            total = amount
-            if existing is not None:
-                total += existing.amount
-                self.db.prefix_db.support_amount.stage_delete((supported_claim,), existing)
-            self.db.prefix_db.support_amount.stage_put((supported_claim,), (total,))
+        support_amount = prefix_db.support_amount
+        pending_amounts = list(self.pending_support_amount_change.items())
+        existing_amounts = support_amount.multi_get([(claim_hash,) for claim_hash, _ in pending_amounts])
+        support_amount.stage_multi_delete(
+            [((claim_hash,), existing)
+             for (claim_hash, _), existing in zip(pending_amounts, existing_amounts) if existing is not None]
+        )
+        support_amount.stage_multi_put(
+            [((claim_hash,), (amount if existing is None else amount + existing.amount,))
+             for (claim_hash, amount), existing in zip(pending_amounts, existing_amounts)]
+        )
 
         # use the cumulative changes to update bid ordered resolve
+        self._prefetch_claim_txos(self.removed_claim_hashes)
+        self._prefetch_claim_txos(self.touched_claim_hashes)
+        url_effective_amounts = self._get_url_effective_amounts()
+        stage_delete_effective_amount = prefix_db.effective_amount.stage_delete
+        stage_put_effective_amount = prefix_db.effective_amount.stage_put
         for removed in self.removed_claim_hashes:
-            removed_claim = self.db.get_claim_txo(removed)
+            removed_claim = self._get_claim_txo(removed)
             if removed_claim:
-                amt = self.db.get_url_effective_amount(
-                    removed_claim.normalized_name, removed
-                )
+                amt = url_effective_amounts.get(removed)
                 if amt:
-                    self.db.prefix_db.effective_amount.stage_delete(
+                    stage_delete_effective_amount(
                         (removed_claim.normalized_name, amt.effective_amount, amt.tx_num, amt.position), (removed,)
                     )
         for touched in self.touched_claim_hashes:
             prev_effective_amount = 0
-
-            if touched in self.claim_hash_to_txo:
-                pending = self.txo_to_claim[self.claim_hash_to_txo[touched]]
+            pending_txo = self.claim_hash_to_txo.get(touched)
+            claim_from_db = self._get_claim_txo(touched)
+            if pending_txo is not None:
+                pending = self.txo_to_claim[pending_txo]
                 name, tx_num, position = pending.normalized_name, pending.tx_num, pending.position
-                claim_from_db = self.db.get_claim_txo(touched)
-                if claim_from_db:
-                    claim_amount_info = self.db.get_url_effective_amount(name, touched)
-                    if claim_amount_info:
-                        prev_effective_amount = claim_amount_info.effective_amount
-                        self.db.prefix_db.effective_amount.stage_delete(
-                            (name, claim_amount_info.effective_amount, claim_amount_info.tx_num,
-                             claim_amount_info.position), (touched,)
-                        )
+            elif claim_from_db:
+                name, tx_num, position = claim_from_db.normalized_name, claim_from_db.tx_num, claim_from_db.position
             else:
-                v = self.db.get_claim_txo(touched)
-                if not v:
-                    continue
-                name, tx_num, position = v.normalized_name, v.tx_num, v.position
-                amt = self.db.get_url_effective_amount(name, touched)
-                if amt:
-                    prev_effective_amount = amt.effective_amount
-                    self.db.prefix_db.effective_amount.stage_delete(
-                        (name, prev_effective_amount, amt.tx_num, amt.position), (touched,)
+                continue
+            if claim_from_db:
+                claim_amount_info = url_effective_amounts.get(touched)
+                if claim_amount_info:
+                    prev_effective_amount = claim_amount_info.effective_amount
+                    stage_delete_effective_amount(
+                        (name, prev_effective_amount, claim_amount_info.tx_num, claim_amount_info.position),
+                        (touched,)
                     )
 
-            new_effective_amount = self._get_pending_effective_amount(name, touched)
-            self.db.prefix_db.effective_amount.stage_put(
-                (name, new_effective_amount, tx_num, position), (touched,)
-            )
-            if touched in self.claim_hash_to_txo or touched in self.removed_claim_hashes \
+            new_effective_amount = self._get_final_pending_effective_amount(name, touched)
+            stage_put_effective_amount((name, new_effective_amount, tx_num, position), (touched,))
+            if pending_txo is not None or touched in self.removed_claim_hashes \
                     or touched in self.pending_support_amount_change:
                 # exclude sending notifications for claims/supports that activated but
                 # weren't added/spent in this block
                 self._add_claim_activation_change_notification(
-                    touched.hex(), height, prev_effective_amount, new_effective_amount
+                    touched, height, prev_effective_amount, new_effective_amount
                 )
 
+        channel_counts = prefix_db.channel_count
         for channel_hash, count in self.pending_channel_counts.items():
             if count != 0:
-                channel_count_val = self.db.prefix_db.channel_count.get(channel_hash)
+                channel_count_val = channel_counts.get(channel_hash)
                 channel_count = 0 if not channel_count_val else channel_count_val.count
                 if channel_count_val is not None:
-                    self.db.prefix_db.channel_count.stage_delete((channel_hash,), (channel_count,))
-                self.db.prefix_db.channel_count.stage_put((channel_hash,), (channel_count + count,))
+                    channel_counts.stage_delete((channel_hash,), (channel_count,))
+                channel_counts.stage_put((channel_hash,), (channel_count + count,))
 
-        self.touched_claim_hashes.update(
-            {k for k in self.pending_reposted if k not in self.removed_claim_hashes}
-        )
-        self.touched_claim_hashes.update(
-            {k for k, v in self.pending_channel_counts.items() if v != 0 and k not in self.removed_claim_hashes}
-        )
+        self.touched_claim_hashes.update(self.pending_reposted)
+        self.touched_claim_hashes.update(k for k, v in self.pending_channel_counts.items() if v != 0)
+        self.touched_claim_hashes.difference_update(self.removed_claim_hashes)
         self.touched_claims_to_send_es.update(self.touched_claim_hashes)
         self.touched_claims_to_send_es.difference_update(self.removed_claim_hashes)
         self.removed_claims_to_send_es.update(self.removed_claim_hashes)
@@ -1444,19 +1689,32 @@ class BlockProcessor:
         add_utxo = self.add_utxo
         spend_claim_or_support_txo = self._spend_claim_or_support_txo
         add_claim_or_support = self._add_claim_or_support
+        hashXs_by_tx = self.hashXs_by_tx
+        abandon_claim = self._abandon_claim
+        pending_transactions = self.pending_transactions
+        pending_transaction_num_mapping = self.pending_transaction_num_mapping
+        cache_all_tx_hashes = self.env.cache_all_tx_hashes
+        prefix_db = self.db.prefix_db
+        stage_put_tx = prefix_db.tx.stage_put
+        stage_put_tx_num = prefix_db.tx_num.stage_put
+        stage_put_tx_hash = prefix_db.tx_hash.stage_put
         txs: List[Tuple[Tx, bytes]] = block.transactions
 
-        self.db.prefix_db.block_hash.stage_put(key_args=(height,), value_args=(self.coin.header_hash(block.header),))
-        self.db.prefix_db.header.stage_put(key_args=(height,), value_args=(block.header,))
-        self.db.prefix_db.block_txs.stage_put(key_args=(height,), value_args=([tx_hash for tx, tx_hash in txs],))
+        header_hash = self.coin.header_hash(block.header)
+        prefix_db.block_hash.stage_put(key_args=(height,), value_args=(header_hash,))
+        prefix_db.header.stage_put(key_args=(height,), value_args=(block.header,))
+        prefix_db.block_txs.stage_put(key_args=(height,), value_args=([tx_hash for tx, tx_hash in txs],))
+
+        # only transactions with claim or support outputs need to be fully parsed
+        txos_by_tx = [Transaction(tx.raw).outputs if has_claim_outputs(tx) else None for tx, _ in txs]
+        self._prefetch_signing_channels(txos_by_tx)
 
-        for tx, tx_hash in txs:
+        for (tx, tx_hash), txos in zip(txs, txos_by_tx):
             spent_claims = {}
-            txos = Transaction(tx.raw).outputs
 
-            self.db.prefix_db.tx.stage_put(key_args=(tx_hash,), value_args=(tx.raw,))
-            self.db.prefix_db.tx_num.stage_put(key_args=(tx_hash,), value_args=(tx_count,))
-            self.db.prefix_db.tx_hash.stage_put(key_args=(tx_count,), value_args=(tx_hash,))
+            stage_put_tx(key_args=(tx_hash,), value_args=(tx.raw,))
+            stage_put_tx_num(key_args=(tx_hash,), value_args=(tx_count,))
+            stage_put_tx_hash(key_args=(tx_count,), value_args=(tx_hash,))
 
             # Spend the inputs
             for txin in tx.inputs:
@@ -1465,8 +1723,10 @@ class BlockProcessor:
                 # spend utxo for address histories
                 hashX = spend_utxo(txin.prev_hash, txin.prev_idx)
                 if hashX:
-                    if tx_count not in self.hashXs_by_tx[hashX]:
-                        self.hashXs_by_tx[hashX].append(tx_count)
+                    # tx nums are appended in order, so only the last one can be the current tx
+                    history = hashXs_by_tx[hashX]
+                    if not history or history[-1] != tx_count:
+                        history.append(tx_count)
                 # spend claim/support txo
                 spend_claim_or_support_txo(height, txin, spent_claims)
 
@@ -1476,12 +1736,14 @@ class BlockProcessor:
                 hashX = add_utxo(tx_hash, tx_count, nout, txout)
                 if hashX:
                     # self._set_hashX_cache(hashX)
-                    if tx_count not in self.hashXs_by_tx[hashX]:
-                        self.hashXs_by_tx[hashX].append(tx_count)
+                    history = hashXs_by_tx[hashX]
+                    if not history or history[-1] != tx_count:
+                        history.append(tx_count)
                 # add claim/support txo
-                add_claim_or_support(
-                    height, tx_hash, tx_count, nout, txos[nout], spent_claims
-                )
+                if txos:
+                    add_claim_or_support(
+                        height, tx_hash, tx_count, nout, txos[nout], spent_claims
+                    )
 
             # Handle abandoned claims
             abandoned_channels = {}
@@ -1492,14 +1754,14 @@ class BlockProcessor:
                     abandoned_channels[abandoned_claim_hash] = (tx_num, nout, normalized_name)
                 else:
                     # print(f"\tabandon {normalized_name} {abandoned_claim_hash.hex()} {tx_num} {nout}")
-                    self._abandon_claim(abandoned_claim_hash, tx_num, nout, normalized_name)
+                    abandon_claim(abandoned_claim_hash, tx_num, nout, normalized_name)
 
             for abandoned_claim_hash, (tx_num, nout, normalized_name) in abandoned_channels.items():
                 # print(f"\tabandon {normalized_name} {abandoned_claim_hash.hex()} {tx_num} {nout}")
-                self._abandon_claim(abandoned_claim_hash, tx_num, nout, normalized_name)
-            self.pending_transactions[tx_count] = tx_hash
-            self.pending_transaction_num_mapping[tx_hash] = tx_count
-            if self.env.cache_all_tx_hashes:
+                abandon_claim(abandoned_claim_hash, tx_num, nout, normalized_name)
+            pending_transactions[tx_count] = tx_hash
+            pending_transaction_num_mapping[tx_hash] = tx_count
+            if cache_all_tx_hashes:
                 self.db.total_transactions.append(tx_hash)
                 self.db.tx_num_mapping[tx_hash] = tx_count
             tx_count += 1
@@ -1513,12 +1775,13 @@ class BlockProcessor:
         # update effective amount and update sets of touched and deleted claims
         self._get_cumulative_update_ops(height)
 
-        self.db.prefix_db.tx_count.stage_put(key_args=(height,), value_args=(tx_count,))
+        prefix_db.tx_count.stage_put(key_args=(height,), value_args=(tx_count,))
 
-        for hashX, new_history in self.hashXs_by_tx.items():
-            if not new_history:
-                continue
-            self.db.prefix_db.hashX_history.stage_put(key_args=(hashX, height), value_args=(new_history,))
+        pack_hashX_history = prefix_db.hashX_history.pack_item
+        prefix_db.stage_raw_ops(
+            RevertablePut(*pack_hashX_history(hashX, height, new_history))
+            for hashX, new_history in hashXs_by_tx.items() if new_history
+        )
 
         self.tx_count = tx_count
         self.db.tx_counts.append(self.tx_count)
@@ -1526,24 +1789,25 @@ class BlockProcessor:
         cached_max_reorg_depth = self.daemon.cached_height() - self.env.reorg_limit
 
         # if height >= cached_max_reorg_depth:
-        self.db.prefix_db.touched_or_deleted.stage_put(
+        prefix_db.touched_or_deleted.stage_put(
             key_args=(height,), value_args=(self.touched_claim_hashes, self.removed_claim_hashes)
         )
 
         self.height = height
         self.db.headers.append(block.header)
-        self.tip = self.coin.header_hash(block.header)
+        self.tip = header_hash
 
         min_height = self.db.min_undo_height(self.db.db_height)
         if min_height > 0:  # delete undos for blocks deep enough they can't be reorged
-            undo_to_delete = list(self.db.prefix_db.undo.iterate(start=(0,), stop=(min_height,)))
-            for (k, v) in undo_to_delete:
-                self.db.prefix_db.undo.stage_delete((k,), (v,))
-            touched_or_deleted_to_delete = list(self.db.prefix_db.touched_or_deleted.iterate(
-                start=(0,), stop=(min_height,))
+            prefix_db.undo.stage_multi_delete(
+                [((k,), (v,)) for k, v in prefix_db.undo.iterate(start=(0,), stop=(min_height,))]
+            )
+        # keep the touched claims of the blocks not yet in ES, the elastic sync reads them from es_sync_height
+        min_touched_height = min(min_height, self.es_sync_height)
+        if min_touched_height > 0:
+            prefix_db.touched_or_deleted.stage_multi_delete(
+                list(prefix_db.touched_or_deleted.iterate(start=(0,), stop=(min_touched_height,)))
             )
-            for (k, v) in touched_or_deleted_to_delete:
-                self.db.prefix_db.touched_or_deleted.stage_delete(k, v)
 
         self.db.fs_height = self.height
         self.db.fs_tx_count = self.tx_count
@@ -1553,6 +1817,7 @@ class BlockProcessor:
         self.db.db_height = self.height
         self.db.db_tx_count = self.tx_count
         self.db.db_tip = self.tip
+        self.db.es_sync_height = self.es_sync_height
         self.db.last_flush_tx_count = self.db.fs_tx_count
         now = time.time()
         self.db.wall_time += now - self.db.last_flush
@@ -1560,8 +1825,13 @@ class BlockProcessor:
         self.db.write_db_state()
 
     def clear_after_advance_or_reorg(self):
+        for claim_hash in self.pending_channels:
+            self.channel_pub_key_cache.pop(claim_hash, None)
+        for claim_hash in self.abandoned_claims:
+            self.channel_pub_key_cache.pop(claim_hash, None)
         self.txo_to_claim.clear()
         self.claim_hash_to_txo.clear()
+        self.pending_signed_claims_by_channel.clear()
         self.support_txos_by_claim.clear()
         self.support_txo_to_claim.clear()
         self.removed_support_txos_by_name_by_claim.clear()
@@ -1574,7 +1844,10 @@ class BlockProcessor:
         self.possible_future_support_amounts_by_claim_hash.clear()
         self.possible_future_support_txos_by_claim_hash.clear()
         self.pending_channels.clear()
+        self.claim_txo_cache.clear()
         self.amount_cache.clear()
+        self.effective_amount_cache.clear()
+        self.claims_for_name_cache.clear()
         self.signatures_changed.clear()
         self.expired_claim_hashes.clear()
         self.doesnt_have_valid_signature.clear()
@@ -1604,6 +1877,9 @@ class BlockProcessor:
 
         # self.db.assert_flushed(self.flush_data())
         self.logger.info("backup block %i", self.height)
+        # the rollback may restore older versions of channels, drop all cached public keys
+        self.channel_pub_key_cache.clear()
+        self.controlling_claim_cache.clear()
         # Check and update self.tip
 
         self.db.headers.pop()
@@ -1670,16 +1946,17 @@ class BlockProcessor:
             return hashX
 
     def get_pending_tx_num(self, tx_hash: bytes) -> int:
-        if tx_hash in self.pending_transaction_num_mapping:
-            return self.pending_transaction_num_mapping[tx_hash]
-        else:
+        tx_num = self.pending_transaction_num_mapping.get(tx_hash)
+        if tx_num is None:
             return self.db.get_tx_num(tx_hash)
+        return tx_num
 
     def spend_utxo(self, tx_hash: bytes, nout: int):
         hashX, amount = self.utxo_cache.pop((tx_hash, nout), (None, None))
         txin_num = self.get_pending_tx_num(tx_hash)
+        short_tx_hash = tx_hash[:4]
         if not hashX:
-            hashX_value = self.db.prefix_db.hashX_utxo.get(tx_hash[:4], txin_num, nout)
+            hashX_value = self.db.prefix_db.hashX_utxo.get(short_tx_hash, txin_num, nout)
             if not hashX_value:
                 return
             hashX = hashX_value.hashX
@@ -1692,11 +1969,11 @@ class BlockProcessor:
                     f"{hash_to_hex_str(tx_hash)}:{nout} is not found in UTXO db for {hash_to_hex_str(hashX)}"
                 )
             self.touched_hashXs.add(hashX)
-            self.db.prefix_db.hashX_utxo.stage_delete((tx_hash[:4], txin_num, nout), hashX_value)
+            self.db.prefix_db.hashX_utxo.stage_delete((short_tx_hash, txin_num, nout), hashX_value)
             self.db.prefix_db.utxo.stage_delete((hashX, txin_num, nout), utxo_value)
             return hashX
         elif amount is not None:
-            self.db.prefix_db.hashX_utxo.stage_delete((tx_hash[:4], txin_num, nout), (hashX,))
+            self.db.prefix_db.hashX_utxo.stage_delete((short_tx_hash, txin_num, nout), (hashX,))
             self.db.prefix_db.utxo.stage_delete((hashX, txin_num, nout), (amount,))
             self.touched_hashXs.add(hashX)
             return hashX
@@ -1717,16 +1994,16 @@ class BlockProcessor:
                 self.logger.exception("error while processing txs")
                 raise
 
-    async def _es_caught_up(self):
-        self.db.es_sync_height = self.height
-
-        def flush():
-            assert len(self.db.prefix_db._op_stack) == 0
-            self.db.write_db_state()
-            self.db.prefix_db.unsafe_commit()
-            self.db.assert_db_state()
-
-        await self.run_in_thread_with_lock(flush)
+    def _write_es_sync_height(self):
+        """Save the height the search index was synced to, it's otherwise only written with the db state of the
+        next block and a restart would sync the claims from the last blocks to ES again.
+        """
+        prefix_db = self.db.prefix_db
+        if prefix_db is None or len(prefix_db._op_stack) or self.db.es_sync_height == self.es_sync_height:
+            return
+        self.db.es_sync_height = self.es_sync_height
+        self.db.write_db_state()
+        prefix_db.unsafe_commit()
 
     async def _first_caught_up(self):
         self.logger.info(f'caught up to height {self.height}')
@@ -1769,6 +2046,9 @@ class BlockProcessor:
             self.status_server.set_height(self.db.fs_height, self.db.db_tip)
             await self.db.initialize_caches()
             await self.db.search_index.start()
+            self.es_sync_height = self.db.es_sync_height
+            self._es_queue = asyncio.Queue(maxsize=2)
+            self._es_task = asyncio.create_task(self._es_worker())
             await asyncio.wait([
                 self.prefetcher.main_loop(self.height),
                 self._process_prefetched_blocks()
@@ -1779,9 +2059,10 @@ class BlockProcessor:
             self.logger.exception("Block processing failed!")
             raise
         finally:
+            await self._stop_es_worker()
             self.status_server.stop()
             # Shut down block processing
             self.logger.info('closing the DB for a clean shutdown...')
-            self._sync_reader_executor.shutdown(wait=True)
             self._chain_executor.shutdown(wait=True)
+            self._write_es_sync_height()
             self.db.close()
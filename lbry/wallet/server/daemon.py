@@ -8,7 +8,7 @@ import aiohttp
 from prometheus_client import Gauge, Histogram
 from lbry.utils import LRUCacheWithMetrics
 from lbry.wallet.rpc.jsonrpc import RPCError
-from lbry.wallet.server.util import hex_to_bytes, class_logger
+from lbry.wallet.server.util import hex_to_bytes, class_logger, chunks
 from lbry.wallet.rpc import JSONRPC
 
 
@@ -32,6 +32,8 @@ class Daemon:
 
     WARMING_UP = -28
     id_counter = itertools.count()
+    # number of getblock requests sent in a single json-rpc batch by raw_blocks
+    raw_blocks_batch_size = 50
 
     lbrycrd_request_time_metric = Histogram(
         "lbrycrd_request", "lbrycrd requests count", namespace=NAMESPACE, labelnames=("method",)
@@ -256,16 +258,54 @@ class Daemon:
         return self._block_cache[hex_hash]
 
     async def raw_blocks(self, hex_hashes):
-        """Return the raw binary blocks with the given hex hashes."""
-        params_iterable = ((h, False) for h in hex_hashes)
-        blocks = await self._send_vector('getblock', params_iterable)
-        # Convert hex string to bytes
-        return [hex_to_bytes(block) for block in blocks]
+        """Return the raw binary blocks with the given hex hashes.
+
+        The daemon runs a batch request in a single rpc worker, so large requests are split into
+        several batches that are sent concurrently (bounded by the work queue semaphore)."""
+        batches = await asyncio.gather(*(
+            self._send_vector('getblock', ((h, False) for h in batch))
+            for batch in chunks(hex_hashes, self.raw_blocks_batch_size)
+        ))
+        # Convert hex string to bytes, dropping each batch of hex strings once it's converted
+        # so the hex (twice the size of the blocks) isn't all held until the end
+        raw_blocks = []
+        for blocks in batches:
+            raw_blocks.extend(map(hex_to_bytes, blocks))
+            blocks.clear()
+        return raw_blocks
 
     async def mempool_hashes(self):
         """Update our record of the daemon's mempool hashes."""
         return await self._send_single('getrawmempool')
 
+    async def mempool_hashes_at_height(self):
+        """Return the daemon's height and mempool hashes, read with one
+        batch request.
+
+        The height is read before and after the mempool.  If a block
+        arrived in between, the mempool may be from either height and the
+        height returned is None.  Like height(), this updates the cached
+        height to the last height read in both cases."""
+
+        start = time.perf_counter()
+
+        def processor(result):
+            errs = [item['error'] for item in result if item['error']]
+            if any(err.get('code') == self.WARMING_UP for err in errs):
+                raise WarmingUpError
+            if errs:
+                raise DaemonError(errs)
+            return [item['result'] for item in result]
+
+        payload = [{'method': method, 'id': next(self.id_counter)}
+                   for method in ('getblockcount', 'getrawmempool', 'getblockcount')]
+        height_before, hex_hashes, height = await self._send(payload, processor)
+        self.lbrycrd_request_time_metric.labels(method='getrawmempool').observe(time.perf_counter() - start)
+        self._height = height
+        if height != height_before:
+            return None, hex_hashes
+        return height, hex_hashes
+
     async def estimatefee(self, block_count):
         """Return the fee estimate for the block count.  Units are whole
         currency units per KB, e.g. 0.00000995, or -1 if no estimate
@@ -1,7 +1,7 @@
 import struct
-from typing import Optional
+from typing import Optional, Iterable
 from lbry.wallet.server.db import DB_PREFIXES
-from lbry.wallet.server.db.revertable import RevertableOpStack, RevertablePut, RevertableDelete
+from lbry.wallet.server.db.revertable import RevertableOpStack, RevertableOp, RevertablePut, RevertableDelete
 
 
 class KeyValueStorage:
@@ -40,7 +40,7 @@ class PrefixDB:
             with self._db.write_batch(transaction=True) as batch:
                 batch_put = batch.put
                 batch_delete = batch.delete
-                for staged_change in self._op_stack:
+                for staged_change in self._op_stack.iter_final_ops():
                     if staged_change.is_put:
                         batch_put(staged_change.key, staged_change.value)
                     else:
@@ -64,7 +64,7 @@ class PrefixDB:
             with self._db.write_batch(transaction=True) as batch:
                 batch_put = batch.put
                 batch_delete = batch.delete
-                for staged_change in self._op_stack:
+                for staged_change in self._op_stack.iter_final_ops():
                     if staged_change.is_put:
                         batch_put(staged_change.key, staged_change.value)
                     else:
@@ -85,7 +85,7 @@ class PrefixDB:
             with self._db.write_batch(transaction=True) as batch:
                 batch_put = batch.put
                 batch_delete = batch.delete
-                for staged_change in self._op_stack:
+                for staged_change in self._op_stack.iter_final_ops():
                     if staged_change.is_put:
                         batch_put(staged_change.key, staged_change.value)
                     else:
@@ -117,3 +117,6 @@ class PrefixDB:
 
     def stage_raw_delete(self, key: bytes, value: bytes):
         self._op_stack.append_op(RevertableDelete(key, value))
+
+    def stage_raw_ops(self, ops: Iterable[RevertableOp]):
+        self._op_stack.extend_ops(ops)
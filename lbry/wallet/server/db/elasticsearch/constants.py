@@ -21,11 +21,9 @@ INDEX_DEFAULT_SETTINGS = {
                         "type": "keyword"
                     }
                 },
-                "type": "text",
-                "index_prefixes": {
-                    "min_chars": 1,
-                    "max_chars": 10
-                }
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
             },
             "sd_hash": {
                 "fields": {
@@ -34,21 +32,34 @@ INDEX_DEFAULT_SETTINGS = {
                         "type": "keyword"
                     }
                 },
-                "type": "text",
-                "index_prefixes": {
-                    "min_chars": 1,
-                    "max_chars": 4
-                }
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
             },
             "height": {"type": "integer"},
+            "creation_height": {"type": "integer"},
+            "activation_height": {"type": "integer"},
+            "expiration_height": {"type": "integer"},
+            "tx_nout": {"type": "integer"},
+            "tx_position": {"type": "integer"},
+            "repost_count": {"type": "integer"},
             "claim_type": {"type": "byte"},
             "censor_type": {"type": "byte"},
+            "amount": {"type": "long"},
+            "effective_amount": {"type": "long"},
+            "support_amount": {"type": "long"},
+            "fee_amount": {"type": "long"},
             "trending_score": {"type": "double"},
             "release_time": {"type": "long"}
         }
     }
 }
 
+# dynamic index settings applied while bulk loading the whole index and restored once it is done,
+# refresh_interval stays disabled in both since the index is refreshed explicitly after writing to it
+BULK_SETTINGS = {"index": {"translog": {"durability": "async"}}}
+LIVE_SETTINGS = {"index": {"translog": {"durability": "request"}}}
+
 FIELDS = {
     '_id',
     'claim_id', 'claim_type', 'claim_name', 'normalized_name',
@@ -98,3 +109,9 @@ REPLACEMENTS = {
     'media_types': 'media_type',
     'valid_channel_signature': 'is_signature_valid'
 }
+
+# field name or alias: (field name, is in FIELDS, is in TEXT_FIELDS, is in RANGE_FIELDS)
+FIELD_INFO = {
+    name: (field, field in FIELDS, field in TEXT_FIELDS, field in RANGE_FIELDS)
+    for name, field in ((name, REPLACEMENTS.get(name, name)) for name in ALL_FIELDS.union(REPLACEMENTS))
+}
@@ -15,8 +15,7 @@ from lbry.schema.tags import clean_tags
 from lbry.schema.url import URL, normalize_name
 from lbry.utils import LRUCache
 from lbry.wallet.server.db.common import CLAIM_TYPES, STREAM_TYPES
-from lbry.wallet.server.db.elasticsearch.constants import INDEX_DEFAULT_SETTINGS, REPLACEMENTS, FIELDS, TEXT_FIELDS, \
-    RANGE_FIELDS, ALL_FIELDS
+from lbry.wallet.server.db.elasticsearch.constants import INDEX_DEFAULT_SETTINGS, ALL_FIELDS, FIELD_INFO
 from lbry.wallet.server.util import class_logger
 from lbry.wallet.server.db.common import ResolveResult
 
@@ -40,7 +39,7 @@ class IndexVersionMismatch(Exception):
 
 
 class SearchIndex:
-    VERSION = 1
+    VERSION = 2
 
     def __init__(self, index_prefix: str, search_timeout=3.0, elastic_host='localhost', elastic_port=9200):
         self.search_timeout = search_timeout
@@ -126,16 +125,15 @@ class SearchIndex:
             self.logger.debug("Indexing done for %d claims.", count)
 
     async def claim_consumer(self, claim_producer):
-        touched = set()
+        failed = set()
         async for ok, item in async_streaming_bulk(self.sync_client, self._consume_claim_producer(claim_producer),
                                                    raise_on_error=False):
             if not ok:
                 self.logger.warning("indexing failed for an item: %s", item)
-            else:
-                item = item.popitem()[1]
-                touched.add(item['_id'])
+                failed.add(next(iter(item.values()))['_id'])
         await self.sync_client.indices.refresh(self.index)
         self.logger.debug("Indexing done.")
+        return failed
 
     def update_filter_query(self, censor_type, blockdict, channels=False):
         blockdict = {blocked.hex(): blocker.hex() for blocked, blocker in blockdict.items()}
@@ -272,9 +270,9 @@ class SearchIndex:
         start = time.perf_counter()
 
         def producer():
-            for claim_id, claim_updates in params.items():
+            for claim_hash, claim_updates in params.items():
                 yield {
-                    '_id': claim_id,
+                    '_id': claim_hash.hex(),
                     '_index': self.index,
                     '_op_type': 'update',
                     'script': {
@@ -544,8 +542,8 @@ def expand_query(**kwargs):
             value = list(filter(None, value))
         if value is None or isinstance(value, list) and len(value) == 0:
             continue
-        key = REPLACEMENTS.get(key, key)
-        if key in FIELDS:
+        key, is_field, is_text, is_range = FIELD_INFO.get(key) or (key, False, False, False)
+        if is_field:
             partial_id = False
             if key == 'claim_type':
                 if isinstance(value, str):
@@ -563,18 +561,18 @@ def expand_query(**kwargs):
                 partial_id = True
             if key in ('signature_valid', 'has_source'):
                 continue  # handled later
-            if key in TEXT_FIELDS:
+            if is_text:
                 key += '.keyword'
             ops = {'<=': 'lte', '>=': 'gte', '<': 'lt', '>': 'gt'}
             if partial_id:
                 query['must'].append({"prefix": {key: value}})
-            elif key in RANGE_FIELDS and isinstance(value, str) and value[0] in ops:
+            elif is_range and isinstance(value, str) and value[0] in ops:
                 operator_length = 2 if value[:2] in ops else 1
                 operator, value = value[:operator_length], value[operator_length:]
                 if key == 'fee_amount':
                     value = str(Decimal(value)*1000)
                 query['must'].append({"range": {key: {ops[operator]: value}}})
-            elif key in RANGE_FIELDS and isinstance(value, list) and all(v[0] in ops for v in value):
+            elif is_range and isinstance(value, list) and all(v[0] in ops for v in value):
                 range_constraints = []
                 for v in value:
                     operator_length = 2 if v[:2] in ops else 1
@@ -656,8 +654,8 @@ def expand_query(**kwargs):
                 continue
             is_asc = value.startswith('^')
             value = value[1:] if is_asc else value
-            value = REPLACEMENTS.get(value, value)
-            if value in TEXT_FIELDS:
+            value, _, is_text, _ = FIELD_INFO.get(value) or (value, False, False, False)
+            if is_text:
                 value += '.keyword'
             query['sort'].append({value: "asc" if is_asc else "desc"})
     if collapse:
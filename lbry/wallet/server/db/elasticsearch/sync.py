@@ -7,7 +7,7 @@ from elasticsearch.helpers import async_streaming_bulk
 from lbry.wallet.server.env import Env
 from lbry.wallet.server.leveldb import LevelDB
 from lbry.wallet.server.db.elasticsearch.search import SearchIndex, IndexVersionMismatch
-from lbry.wallet.server.db.elasticsearch.constants import ALL_FIELDS
+from lbry.wallet.server.db.elasticsearch.constants import ALL_FIELDS, BULK_SETTINGS, LIVE_SETTINGS
 
 
 async def get_recent_claims(env, index_name='claims', db=None):
@@ -105,14 +105,23 @@ async def make_es_index_and_run_sync(env: Env, clients=32, force=False, db=None,
         index.stop()
 
     es = AsyncElasticsearch([{'host': env.elastic_host, 'port': env.elastic_port}])
-    if force or created:
+    bulk_load = force or created
+    if bulk_load:
         claim_generator = get_all_claims(env, index_name=index_name, db=db)
     else:
         claim_generator = get_recent_claims(env, index_name=index_name, db=db)
     try:
-        async for ok, item in async_streaming_bulk(es, claim_generator, request_timeout=600, raise_on_error=False):
-            if not ok:
-                logging.warning("indexing failed for an item: %s", item)
+        if bulk_load:
+            await es.indices.put_settings(BULK_SETTINGS, index=index_name)
+        try:
+            async for ok, item in async_streaming_bulk(es, claim_generator, request_timeout=600, raise_on_error=False):
+                if not ok:
+                    logging.warning("indexing failed for an item: %s", item)
+        finally:
+            if bulk_load:
+                await es.indices.put_settings(LIVE_SETTINGS, index=index_name)
+                # persist the translog that was only synced asynchronously during the load
+                await es.indices.flush(index=index_name)
         await es.indices.refresh(index=index_name)
     finally:
         await es.close()
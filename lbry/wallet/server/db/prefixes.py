@@ -1,7 +1,9 @@
+import sys
 import typing
 import struct
 import array
 import base64
+from functools import lru_cache
 from typing import Union, Tuple, NamedTuple, Optional
 from lbry.wallet.server.db import DB_PREFIXES
 from lbry.wallet.server.db.db import KeyValueStorage, PrefixDB
@@ -11,10 +13,13 @@ from lbry.schema.url import normalize_name
 ACTIVATED_CLAIM_TXO_TYPE = 1
 ACTIVATED_SUPPORT_TXO_TYPE = 2
 
+NAME_LENGTH_STRUCT = struct.Struct(b'>H')
 
+
+@lru_cache(2 ** 14)
 def length_encoded_name(name: str) -> bytes:
     encoded = name.encode('utf-8')
-    return len(encoded).to_bytes(2, byteorder='big') + encoded
+    return NAME_LENGTH_STRUCT.pack(len(encoded)) + encoded
 
 
 def length_prefix(key: str) -> bytes:
@@ -85,6 +90,16 @@ class PrefixRow(metaclass=PrefixRowType):
         if v:
             return v if not deserialize_value else self.unpack_value(v)
 
+    def multi_get(self, key_args: typing.List[typing.Tuple], fill_cache=True, deserialize_value=True):
+        packed_keys = [self.pack_key(*args) for args in key_args]
+        db_get = self._db.get
+        # read in key order so that reads of neighbouring keys hit the same blocks
+        values = {key: db_get(key, fill_cache=fill_cache) for key in sorted(set(packed_keys))}
+        if not deserialize_value:
+            return [values[key] or None for key in packed_keys]
+        unpack_value = self.unpack_value
+        return [None if not values[key] else unpack_value(values[key]) for key in packed_keys]
+
     def get_pending(self, *key_args, fill_cache=True, deserialize_value=True):
         packed_key = self.pack_key(*key_args)
         last_op = self._op_stack.get_last_op_for_key(packed_key)
@@ -103,6 +118,12 @@ class PrefixRow(metaclass=PrefixRowType):
     def stage_delete(self, key_args=(), value_args=()):
         self._op_stack.append_op(RevertableDelete(self.pack_key(*key_args), self.pack_value(*value_args)))
 
+    def stage_multi_put(self, items):
+        self._op_stack.extend_ops([RevertablePut(self.pack_key(*k), self.pack_value(*v)) for k, v in items])
+
+    def stage_multi_delete(self, items):
+        self._op_stack.extend_ops([RevertableDelete(self.pack_key(*k), self.pack_value(*v)) for k, v in items])
+
     @classmethod
     def pack_partial_key(cls, *args) -> bytes:
         return cls.prefix + cls.key_part_lambdas[len(args)](*args)
@@ -694,6 +715,29 @@ class ClaimShortIDPrefixRow(PrefixRow):
         return cls.pack_key(name, partial_claim_id, root_tx_num, root_position), \
                cls.pack_value(tx_num, position)
 
+    @classmethod
+    def pack_short_id_keys(cls, name: str, claim_id: str, root_tx_num: int, root_position: int,
+                           max_len: int = 10) -> typing.List[bytes]:
+        """Pack the keys for the 1 to max_len character prefixes of a claim id in one pass"""
+        head = cls.prefix + length_encoded_name(name)
+        tail = cls.key_struct.pack(root_tx_num, root_position)
+        encoded = claim_id.encode()
+        return [head + bytes((i,)) + encoded[:i] + tail for i in range(1, max_len + 1)]
+
+    def stage_short_ids_put(self, name: str, claim_id: str, root_tx_num: int, root_position: int,
+                            tx_num: int, position: int):
+        value = self.pack_value(tx_num, position)
+        self._op_stack.extend_ops([
+            RevertablePut(key, value) for key in self.pack_short_id_keys(name, claim_id, root_tx_num, root_position)
+        ])
+
+    def stage_short_ids_delete(self, name: str, claim_id: str, root_tx_num: int, root_position: int,
+                               tx_num: int, position: int):
+        value = self.pack_value(tx_num, position)
+        self._op_stack.extend_ops([
+            RevertableDelete(key, value) for key in self.pack_short_id_keys(name, claim_id, root_tx_num, root_position)
+        ])
+
 
 class ClaimToChannelPrefixRow(PrefixRow):
     prefix = DB_PREFIXES.claim_to_channel.value
@@ -943,7 +987,8 @@ class PendingActivationPrefixRow(PrefixRow):
     def unpack_value(cls, data: bytes) -> PendingActivationValue:
         claim_hash = data[:20]
         name_len = int.from_bytes(data[20:22], byteorder='big')
-        name = data[22:22 + name_len].decode()
+        # the same names are read back many times when processing takeovers, share one copy of each
+        name = sys.intern(data[22:22 + name_len].decode())
         return PendingActivationValue(claim_hash, name)
 
     @classmethod
@@ -1405,7 +1450,9 @@ class HashXHistoryPrefixRow(PrefixRow):
         return HashXHistoryKey(*super().unpack_key(key))
 
     @classmethod
-    def pack_value(cls, history: typing.List[int]) -> bytes:
+    def pack_value(cls, history: Union[typing.List[int], array.array]) -> bytes:
+        if isinstance(history, array.array):
+            return history.tobytes()
         a = array.array('I')
         a.fromlist(history)
         return a.tobytes()
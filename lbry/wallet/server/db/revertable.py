@@ -103,16 +103,17 @@ class RevertableOpStack:
         Apply a put or delete op, checking that it introduces no integrity errors
         """
 
-        inverted = op.invert()
-        if self._items[op.key] and inverted == self._items[op.key][-1]:
-            self._items[op.key].pop()  # if the new op is the inverse of the last op, we can safely null both
-            return
-        elif self._items[op.key] and self._items[op.key][-1] == op:  # duplicate of last op
-            return  # raise an error?
+        staged = self._items[op.key]
+        if staged:
+            if op.invert() == staged[-1]:
+                staged.pop()  # if the new op is the inverse of the last op, we can safely null both
+                return
+            elif staged[-1] == op:  # duplicate of last op
+                return  # raise an error?
         stored_val = self._get(op.key)
         has_stored_val = stored_val is not None
         delete_stored_op = None if not has_stored_val else RevertableDelete(op.key, stored_val)
-        will_delete_existing_stored = False if delete_stored_op is None else (delete_stored_op in self._items[op.key])
+        will_delete_existing_stored = False if delete_stored_op is None else (delete_stored_op in staged)
         try:
             if op.is_put and has_stored_val and not will_delete_existing_stored:
                 raise OpStackIntegrity(
@@ -131,14 +132,15 @@ class RevertableOpStack:
                 log.debug(f"skipping over integrity error: {err}")
             else:
                 raise err
-        self._items[op.key].append(op)
+        staged.append(op)
 
     def extend_ops(self, ops: Iterable[RevertableOp]):
         """
         Apply a sequence of put or delete ops, checking that they introduce no integrity errors
         """
+        append_op = self.append_op
         for op in ops:
-            self.append_op(op)
+            append_op(op)
 
     def clear(self):
         self._items.clear()
@@ -151,6 +153,15 @@ class RevertableOpStack:
             for op in ops:
                 yield op
 
+    def iter_final_ops(self):
+        """
+        Iterate the last op staged for each key, which is the only one that needs to be written to the database
+        (the earlier ops for a key are still needed to make the undo info)
+        """
+        for ops in self._items.values():
+            if ops:
+                yield ops[-1]
+
     def __reversed__(self):
         for key, ops in self._items.items():
             for op in reversed(ops):
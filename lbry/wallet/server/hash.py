@@ -46,14 +46,12 @@ def sha256(x):
 
 def ripemd160(x):
     """Simple wrapper of hashlib ripemd160."""
-    h = _new_hash('ripemd160')
-    h.update(x)
-    return h.digest()
+    return _new_hash('ripemd160', x).digest()
 
 
 def double_sha256(x):
     """SHA-256 of SHA-256, as used extensively in bitcoin."""
-    return sha256(sha256(x))
+    return _sha256(_sha256(x).digest()).digest()
 
 
 def hmac_sha512(key, msg):
@@ -65,7 +63,7 @@ def hash160(x):
     """RIPEMD-160 of SHA-256.
 
     Used to make bitcoin addresses from pubkeys."""
-    return ripemd160(sha256(x))
+    return _new_hash('ripemd160', _sha256(x).digest()).digest()
 
 
 def hash_to_hex_str(x: bytes) -> str:
@@ -81,6 +79,17 @@ def hex_str_to_hash(x: str) -> bytes:
     return hex_to_bytes(x)[::-1]
 
 
+def hex_strs_to_hashes(xs: list) -> list:
+    """Convert a list of displayed hex strings of 32 byte hashes to binary hashes.
+
+    The strings are decoded and reversed together, joining them in reverse order keeps the hashes in order.
+    """
+    raw = hex_to_bytes(''.join(reversed(xs)))[::-1]
+    if len(raw) != 32 * len(xs):
+        return [hex_str_to_hash(x) for x in xs]
+    return [raw[i:i + 32] for i in range(0, len(raw), 32)]
+
+
 class Base58Error(Exception):
     """Exception used for Base58 errors."""
 
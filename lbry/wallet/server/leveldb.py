@@ -419,6 +419,24 @@ class LevelDB:
             if v.claim_hash == claim_hash:
                 return k
 
+    def get_url_effective_amounts(self, claims: Iterable[Tuple[str, bytes]]) -> Dict[bytes, 'EffectiveAmountKey']:
+        """
+        Batched get_url_effective_amount, scans the effective amounts of each name once for all of its claims
+        """
+        claim_hashes_by_name = defaultdict(set)
+        for name, claim_hash in claims:
+            claim_hashes_by_name[name].add(claim_hash)
+        results = {}
+        for name, claim_hashes in claim_hashes_by_name.items():
+            remaining = len(claim_hashes)
+            for k, v in self.prefix_db.effective_amount.iterate(prefix=(name,)):
+                if v.claim_hash in claim_hashes and v.claim_hash not in results:
+                    results[v.claim_hash] = k
+                    remaining -= 1
+                    if not remaining:
+                        break
+        return results
+
     def get_claims_for_name(self, name):
         claims = []
         prefix = self.prefix_db.claim_short_id.pack_partial_key(name) + bytes([1])
@@ -7,15 +7,15 @@
 
 """Mempool handling."""
 import asyncio
-import itertools
+import os
 import time
 import attr
 import typing
 from typing import Set, Optional, Callable, Awaitable
-from collections import defaultdict
+from collections import defaultdict, deque
 from prometheus_client import Histogram
-from lbry.wallet.server.hash import hash_to_hex_str, hex_str_to_hash
-from lbry.wallet.server.util import class_logger, chunks
+from lbry.wallet.server.hash import hash_to_hex_str, hex_strs_to_hashes, double_sha256
+from lbry.wallet.server.util import class_logger, chunks, pack_le_uint32, unpack_le_uint32_from
 from lbry.wallet.server.leveldb import UTXO
 if typing.TYPE_CHECKING:
     from lbry.wallet.server.session import LBRYSessionManager
@@ -30,6 +30,12 @@ class MemPoolTx:
     fee = attr.ib()
     size = attr.ib()
     raw_tx = attr.ib()
+    # the hashXs of in_pairs and out_pairs, set when the tx is accepted
+    hashXs = attr.ib(default=None)
+    # {hashX: net value the tx pays to it}, set when the tx is accepted
+    deltas = attr.ib(default=None)
+    # whether any prevout is a mempool tx, kept up to date as txs leave the mempool
+    has_unconfirmed_inputs = attr.ib(default=False)
 
 
 @attr.s(slots=True)
@@ -60,7 +66,10 @@ class MemPool:
 
         self.logger = class_logger(__name__, self.__class__.__name__)
         self.txs = {}
-        self.hashXs = defaultdict(set)  # None can be a key
+        # hashX: [tx_hash, ...], a tx is only added once per hashX so a list is enough.  None can be a key
+        self.hashXs = defaultdict(list)
+        self._hashes_by_hex = {}  # hex tx hash from the daemon: tx hash, for the last refresh
+        self._cached_txs = {}  # tx hash: MemPoolTx loaded from the cache written at the last shutdown
         self.cached_compact_histogram = []
         self.refresh_secs = refresh_secs
         self.log_status_secs = log_status_secs
@@ -88,7 +97,10 @@ class MemPool:
     def _accept_transactions(self, tx_map, utxo_map, touched):
         """Accept transactions in tx_map to the mempool if all their inputs
         can be found in the existing mempool or a utxo_map from the
-        DB.
+        DB.  Transactions spending outputs of other transactions in tx_map
+        are retried as soon as those are accepted, so a single call
+        accepts whole chains of unconfirmed transactions.  A transaction
+        spending an output already spent by one accepted here is not accepted.
 
         Returns an (unprocessed tx_map, unspent utxo_map) pair.
         """
@@ -96,37 +108,64 @@ class MemPool:
         txs = self.txs
 
         deferred = {}
+        # prev_hash: [(hash, tx), ...] waiting on that transaction in tx_map to be accepted
+        waiting = defaultdict(list)
         unspent = set(utxo_map)
+        spent = set()  # prevouts spent by the txs accepted here
+        queue = deque(tx_map.items())
         # Try to find all prevouts so we can accept the TX
-        for hash, tx in tx_map.items():
+        while queue:
+            hash, tx = queue.popleft()
             in_pairs = []
-            try:
-                for prevout in tx.prevouts:
-                    utxo = utxo_map.get(prevout)
-                    if not utxo:
-                        prev_hash, prev_index = prevout
-                        # Raises KeyError if prev_hash is not in txs
-                        utxo = txs[prev_hash].out_pairs[prev_index]
-                    in_pairs.append(utxo)
-            except KeyError:
+            missing = None
+            for prevout in tx.prevouts:
+                utxo = utxo_map.get(prevout)
+                if not utxo:
+                    prev_tx = txs.get(prevout[0])
+                    if prev_tx is None:
+                        missing = prevout[0]
+                        break
+                    utxo = prev_tx.out_pairs[prevout[1]]
+                in_pairs.append(utxo)
+            if missing is not None:
+                if missing in tx_map:
+                    waiting[missing].append((hash, tx))
+                else:
+                    deferred[hash] = tx
+                continue
+            # the daemon's mempool can't have conflicting txs, but it can change while it's being fetched
+            if not spent.isdisjoint(tx.prevouts):
                 deferred[hash] = tx
                 continue
 
             # Spend the prevouts
+            spent.update(tx.prevouts)
             unspent.difference_update(tx.prevouts)
 
             # Save the in_pairs, compute the fee and accept the TX
-            tx.in_pairs = tuple(in_pairs)
+            tx.in_pairs = in_pairs
             # Avoid negative fees if dealing with generation-like transactions
             # because some in_parts would be missing
             tx.fee = max(0, (sum(v for _, v in tx.in_pairs) -
                              sum(v for _, v in tx.out_pairs)))
+            tx.has_unconfirmed_inputs = any(prev_hash in txs for prev_hash, _ in tx.prevouts)
             txs[hash] = tx
 
-            for hashX, value in itertools.chain(tx.in_pairs, tx.out_pairs):
-                touched.add(hashX)
-                hashXs[hashX].add(hash)
-
+            deltas = defaultdict(int)
+            for hashX, value in tx.in_pairs:
+                deltas[hashX] -= value
+            for hashX, value in tx.out_pairs:
+                deltas[hashX] += value
+            tx.deltas = dict(deltas)
+            tx.hashXs = frozenset(deltas)
+            touched.update(tx.hashXs)
+            for hashX in tx.hashXs:
+                hashXs[hashX].append(hash)
+            queue.extend(waiting.pop(hash, ()))
+
+        # the transactions these were waiting on weren't accepted
+        for dependents in waiting.values():
+            deferred.update(dependents)
         return deferred, {prevout: utxo_map[prevout] for prevout in unspent}
 
     async def _mempool_loop(self, synchronized_event):
@@ -142,18 +181,27 @@ class MemPool:
         """Refresh our view of the daemon's mempool."""
         while True:
             start = time.perf_counter()
-            height = self._daemon.cached_height()
-            hex_hashes = await self._daemon.mempool_hashes()
-            if height != await self._daemon.height():
+            height, hex_hashes = await self._daemon.mempool_hashes_at_height()
+            if height is None:
+                # a block arrived while the mempool was read, read it again
                 continue
-            hashes = {hex_str_to_hash(hh) for hh in hex_hashes}
+            # reuse the hashes converted by the last refresh, most of the mempool is unchanged between them
+            hashes_by_hex = self._hashes_by_hex
+            self._hashes_by_hex = hashes_by_hex = {hh: hashes_by_hex.get(hh) for hh in hex_hashes}
+            new_hex_hashes = [hh for hh, h in hashes_by_hex.items() if h is None]
+            hashes_by_hex.update(zip(new_hex_hashes, hex_strs_to_hashes(new_hex_hashes)))
+            hashes = set(hashes_by_hex.values())
             async with self.lock:
                 new_hashes = hashes.difference(self.notified_mempool_txs)
                 touched = await self._process_mempool(hashes)
+                # forget txs that have left the mempool so the set stays bounded by the mempool size
+                self.notified_mempool_txs.intersection_update(hashes)
                 self.notified_mempool_txs.update(new_hashes)
-                new_touched = {
-                    touched_hashx for touched_hashx, txs in self.hashXs.items() if txs.intersection(new_hashes)
-                }
+                new_touched = set()
+                for tx_hash in new_hashes:
+                    tx = self.txs.get(tx_hash)
+                    if tx is not None:
+                        new_touched.update(tx.hashXs)
             synchronized_event.set()
             synchronized_event.clear()
             await self.on_mempool(touched, new_touched, height)
@@ -175,46 +223,59 @@ class MemPool:
         touched = set()
 
         # First handle txs that have disappeared
-        for tx_hash in set(txs).difference(all_hashes):
+        removed = txs.keys() - all_hashes
+        for tx_hash in removed:
             tx = txs.pop(tx_hash)
-            tx_hashXs = {hashX for hashX, value in tx.in_pairs}
-            tx_hashXs.update(hashX for hashX, value in tx.out_pairs)
+            tx_hashXs = tx.hashXs
             for hashX in tx_hashXs:
                 hashXs[hashX].remove(tx_hash)
                 if not hashXs[hashX]:
                     del hashXs[hashX]
             touched.update(tx_hashXs)
+        if removed:
+            for tx in txs.values():
+                if tx.has_unconfirmed_inputs:
+                    tx.has_unconfirmed_inputs = any(prev_hash in txs for prev_hash, _ in tx.prevouts)
 
         # Process new transactions
-        new_hashes = list(all_hashes.difference(txs))
+        new_hashes = list(all_hashes - txs.keys())
         if new_hashes:
-            fetches = []
-            for hashes in chunks(new_hashes, 200):
-                fetches.append(self._fetch_and_accept(hashes, all_hashes, touched))
             tx_map = {}
-            utxo_map = {}
-            for fetch in asyncio.as_completed(fetches):
-                deferred, unspent = await fetch
-                tx_map.update(deferred)
-                utxo_map.update(unspent)
-
-            prior_count = 0
-            # FIXME: this is not particularly efficient
-            while tx_map and len(tx_map) != prior_count:
-                prior_count = len(tx_map)
-                tx_map, utxo_map = self._accept_transactions(tx_map, utxo_map, touched)
+            if self._cached_txs:
+                # txs loaded from the shutdown cache don't need to be fetched and deserialized again
+                cached_txs, self._cached_txs = self._cached_txs, {}
+                tx_map.update((tx_hash, cached_txs[tx_hash]) for tx_hash in new_hashes if tx_hash in cached_txs)
+                new_hashes = [tx_hash for tx_hash in new_hashes if tx_hash not in tx_map]
+            for fetched in await asyncio.gather(*(self._fetch_txs(hashes) for hashes in chunks(new_hashes, 200))):
+                tx_map.update(fetched)
+
+            # Determine all prevouts not in the mempool, and fetch the
+            # UTXO information from the database with a single lookup.
+            # Failed prevout lookups return None - concurrent database
+            # updates happen - which is relied upon by _accept_transactions.
+            # Ignore prevouts that are generation-like.
+            prevouts = tuple(prevout for tx in tx_map.values()
+                             for prevout in tx.prevouts
+                             if prevout[0] not in all_hashes)
+            utxos = await self._db.lookup_utxos(prevouts)
+            utxo_map = dict(zip(prevouts, utxos))
+
+            tx_map, utxo_map = self._accept_transactions(tx_map, utxo_map, touched)
 
             if tx_map:
                 self.logger.info(f'{len(tx_map)} txs dropped')
 
         return touched
 
-    async def _fetch_and_accept(self, hashes, all_hashes, touched):
-        """Fetch a list of mempool transactions."""
-        raw_txs = await self._daemon.getrawtransactions((hash_to_hex_str(hash) for hash in hashes))
-
+    def _deserialize_txs(self, hashes, raw_txs):
+        """Deserialize raw mempool transactions into MemPoolTx objects
+        without in_pairs.  Runs in an executor, so it must not touch the
+        mempool state.
+        """
         to_hashX = self.coin.hashX_from_script
         deserializer = self.coin.DESERIALIZER
+        # addresses are often reused across the outputs of a batch
+        hashX_by_script = {}
 
         tx_map = {}
         for hash, raw_tx in zip(hashes, raw_txs):
@@ -225,26 +286,79 @@ class MemPool:
             tx, tx_size = deserializer(raw_tx).read_tx_and_vsize()
             # Convert the inputs and outputs into (hashX, value) pairs
             # Drop generation-like inputs from MemPoolTx.prevouts
-            txin_pairs = tuple((txin.prev_hash, txin.prev_idx)
-                               for txin in tx.inputs
-                               if not txin.is_generation())
-            txout_pairs = tuple((to_hashX(txout.pk_script), txout.value)
-                                for txout in tx.outputs)
+            txin_pairs = [(txin.prev_hash, txin.prev_idx)
+                          for txin in tx.inputs
+                          if not txin.is_generation()]
+            txout_pairs = []
+            for txout in tx.outputs:
+                hashX = hashX_by_script.get(txout.pk_script)
+                if hashX is None:
+                    hashX = hashX_by_script[txout.pk_script] = to_hashX(txout.pk_script)
+                txout_pairs.append((hashX, txout.value))
             tx_map[hash] = MemPoolTx(txin_pairs, None, txout_pairs,
                                      0, tx_size, raw_tx)
+        return tx_map
 
-        # Determine all prevouts not in the mempool, and fetch the
-        # UTXO information from the database.  Failed prevout lookups
-        # return None - concurrent database updates happen - which is
-        # relied upon by _accept_transactions. Ignore prevouts that are
-        # generation-like.
-        prevouts = tuple(prevout for tx in tx_map.values()
-                         for prevout in tx.prevouts
-                         if prevout[0] not in all_hashes)
-        utxos = await self._db.lookup_utxos(prevouts)
-        utxo_map = dict(zip(prevouts, utxos))
+    async def _fetch_txs(self, hashes):
+        """Fetch and deserialize a list of mempool transactions."""
+        raw_txs = await self._daemon.getrawtransactions((hash_to_hex_str(hash) for hash in hashes))
+        # deserialize off of the event loop so that the other fetches and sessions aren't blocked on it
+        return await asyncio.get_event_loop().run_in_executor(None, self._deserialize_txs, hashes, raw_txs)
 
-        return self._accept_transactions(tx_map, utxo_map, touched)
+    def _cache_path(self):
+        return os.path.join(self._db.env.db_dir, 'mempool-cache')
+
+    def _read_cache(self):
+        """Read and deserialize the transactions written by _write_cache.
+
+        Transactions that don't match their hash are dropped, the rest are
+        only accepted again by the next refresh if the daemon still has them.
+        Runs in an executor.
+        """
+        path = self._cache_path()
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.remove(path)
+        hashes, raw_txs = [], []
+        offset = 0
+        while offset < len(data):
+            tx_hash = data[offset:offset + 32]
+            size, = unpack_le_uint32_from(data, offset + 32)
+            offset += 36
+            raw_tx = data[offset:offset + size]
+            offset += size
+            if len(raw_tx) == size and double_sha256(raw_tx) == tx_hash:
+                hashes.append(tx_hash)
+                raw_txs.append(raw_tx)
+        return self._deserialize_txs(hashes, raw_txs)
+
+    def _write_cache(self):
+        """Write the raw mempool transactions to disk so that they don't need
+        to be fetched from the daemon again after a restart.  Each is stored
+        as its hash, its uint32 length and the raw transaction.
+        """
+        path = self._cache_path()
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                for tx_hash, tx in self.txs.items():
+                    f.write(tx_hash)
+                    f.write(pack_le_uint32(len(tx.raw_tx)))
+                    f.write(tx.raw_tx)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            self.logger.exception("failed to write the mempool cache")
+            return
+        self.logger.info(f'wrote {len(self.txs):,d} txs to the mempool cache')
+
+    async def _load_cache(self):
+        if not os.path.isfile(self._cache_path()):
+            return
+        try:
+            self._cached_txs = await asyncio.get_event_loop().run_in_executor(None, self._read_cache)
+        except Exception:
+            self.logger.exception("failed to read the mempool cache")
+            return
+        self.logger.info(f'loaded {len(self._cached_txs):,d} txs from the mempool cache')
 
     #
     # External interface
@@ -252,24 +366,25 @@ class MemPool:
 
     async def keep_synchronized(self, synchronized_event):
         """Keep the mempool synchronized with the daemon."""
-        await asyncio.wait([
-            self._mempool_loop(synchronized_event),
-            # self._refresh_histogram(synchronized_event),
-            self._logging(synchronized_event)
-        ])
+        await self._load_cache()
+        try:
+            await asyncio.wait([
+                self._mempool_loop(synchronized_event),
+                # self._refresh_histogram(synchronized_event),
+                self._logging(synchronized_event)
+            ])
+        except asyncio.CancelledError:
+            # shutting down, save the mempool for the next start
+            self._write_cache()
+            raise
 
     async def balance_delta(self, hashX):
         """Return the unconfirmed amount in the mempool for hashX.
 
         Can be positive or negative.
         """
-        value = 0
-        if hashX in self.hashXs:
-            for hash in self.hashXs[hashX]:
-                tx = self.txs[hash]
-                value -= sum(v for h168, v in tx.in_pairs if h168 == hashX)
-                value += sum(v for h168, v in tx.out_pairs if h168 == hashX)
-        return value
+        txs = self.txs
+        return sum(txs[hash].deltas[hashX] for hash in self.hashXs.get(hashX, ()))
 
     def compact_fee_histogram(self):
         """Return a compact fee histogram of the current mempool."""
@@ -290,12 +405,11 @@ class MemPool:
 
     def transaction_summaries(self, hashX):
         """Return a list of MemPoolTxSummary objects for the hashX."""
-        result = []
-        for tx_hash in self.hashXs.get(hashX, ()):
-            tx = self.txs[tx_hash]
-            has_ui = any(hash in self.txs for hash, idx in tx.prevouts)
-            result.append(MemPoolTxSummary(tx_hash, tx.fee, has_ui))
-        return result
+        txs = self.txs
+        return [
+            MemPoolTxSummary(tx_hash, txs[tx_hash].fee, txs[tx_hash].has_unconfirmed_inputs)
+            for tx_hash in self.hashXs.get(hashX, ())
+        ]
 
     async def unordered_UTXOs(self, hashX):
         """Return an unordered list of UTXO named tuples from mempool
@@ -320,15 +434,13 @@ class MemPool:
         # +num: confirmed in a specific block (height)
         if tx_hash not in self.txs:
             return -2
-        tx = self.txs[tx_hash]
-        unspent_inputs = sum(1 if hash in self.txs else 0 for hash, idx in tx.prevouts)
-        if unspent_inputs:
+        if self.txs[tx_hash].has_unconfirmed_inputs:
             return -1
         return 0
 
     async def _maybe_notify(self, new_touched):
         tmp, tbp = self._touched_mp, self._touched_bp
-        common = set(tmp).intersection(tbp)
+        common = tmp.keys() & tbp.keys()
         if common:
             height = max(common)
         elif tmp and max(tmp) == self._highest_block:
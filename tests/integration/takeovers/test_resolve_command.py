@@ -1426,6 +1426,40 @@ class ResolveClaimTakeovers(BaseResolveTestCase):
         second_claim_id = (await self.stream_create(name, '0.1', allow_duplicate_name=True))['outputs'][0]['claim_id']
         await self.assertNameState(272, name, second_claim_id, last_takeover_height=272, non_winning_claims=[])
 
+    async def test_takeover_delay_after_abandoning_controlling_claim(self):
+        name = 'derp'
+        first_claim_id = await self.create_stream_claim('1.0', name)
+        await self.generate(320)
+        second_claim_id = await self.create_stream_claim('0.5', name)
+        await self.generate(10)
+        await self.assertNameState(
+            height=538, name=name, winning_claim_id=first_claim_id, last_takeover_height=207,
+            non_winning_claims=[ClaimStateValue(second_claim_id, activation_height=538, active_in_lbrycrd=True)]
+        )
+        # abandoning the controlling claim hands the name to the active claim
+        await self.daemon.jsonrpc_txo_spend(type='stream', claim_id=first_claim_id)
+        await self.generate(1)
+        await self.assertNameState(
+            height=539, name=name, winning_claim_id=second_claim_id, last_takeover_height=539, non_winning_claims=[]
+        )
+        await self.generate(63)
+        # the delay for a new claim comes from the takeover at 539, not from the abandoned claim's at 207
+        third_claim_id = await self.create_stream_claim('2.0', name)
+        await self.assertNameState(
+            height=603, name=name, winning_claim_id=second_claim_id, last_takeover_height=539,
+            non_winning_claims=[ClaimStateValue(third_claim_id, activation_height=605, active_in_lbrycrd=False)]
+        )
+        await self.generate(1)
+        await self.assertNameState(
+            height=604, name=name, winning_claim_id=second_claim_id, last_takeover_height=539,
+            non_winning_claims=[ClaimStateValue(third_claim_id, activation_height=605, active_in_lbrycrd=False)]
+        )
+        await self.generate(1)
+        await self.assertNameState(
+            height=605, name=name, winning_claim_id=third_claim_id, last_takeover_height=605,
+            non_winning_claims=[ClaimStateValue(second_claim_id, activation_height=538, active_in_lbrycrd=True)]
+        )
+
     async def test_trending(self):
         async def get_trending_score(claim_id):
             return (await self.conductor.spv_node.server.bp.db.search_index.search(
@@ -1533,6 +1567,30 @@ class ResolveAfterReorg(BaseResolveTestCase):
         self.assertIn('error', await self.resolve(channel_name))
         self.assertIn('error', await self.resolve(stream_name))
 
+    async def test_reorg_takeover(self):
+        # the controlling claims cached by the block processor must not outlive the blocks that are undone
+        self.assertEqual(self.ledger.headers.height, 206)
+        name = 'derp'
+        first_claim_id = self.get_claim_id(await self.stream_create(name, '1.0'))
+        await self.daemon.jsonrpc_txo_spend(type='stream', claim_id=first_claim_id)
+        second_claim_id = self.get_claim_id(await self.stream_create(name, '1.0', allow_duplicate_name=True))
+        self.assertEqual(self.ledger.headers.height, 208)
+        await self.assertMatchClaimIsWinning(name, second_claim_id)
+        await self.support_create(second_claim_id, '0.1')
+        await self.assertMatchClaimIsWinning(name, second_claim_id)
+
+        # undo the takeover at 208, the txs are mined again in the new blocks
+        await self.reorg(208)
+        self.assertEqual(self.ledger.headers.height, 210)
+        await self.assertBlockHash(208)
+        await self.assertMatchClaimIsWinning(name, second_claim_id)
+        await self.assertNoClaim(first_claim_id)
+
+        third_claim_id = self.get_claim_id(await self.stream_create(name, '2.0', allow_duplicate_name=True))
+        await self.assertMatchClaimIsWinning(name, third_claim_id)
+        await self.reorg(211)
+        await self.assertMatchClaimIsWinning(name, third_claim_id)
+
     async def test_reorg_change_claim_height(self):
         # sanity check
         result = await self.resolve('hovercraft')  # TODO: do these for claim_search and resolve both
@@ -0,0 +1,155 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from lbry.testcase import AsyncioTestCase
+from lbry.utils import LRUCache
+from lbry.wallet.server.block_processor import BlockProcessor
+from lbry.wallet.server.util import class_logger
+
+
+class FakeSearchIndex:
+    def __init__(self):
+        self.indexed = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+        self.error = None
+        self.failed = set()
+
+    async def claim_consumer(self, claim_producer):
+        await self.blocked.wait()
+        async for op, doc in claim_producer:
+            self.indexed.append((op, doc))
+        if self.error:
+            raise self.error
+        return self.failed
+
+    async def apply_filters(self, *filters):
+        pass
+
+    async def update_trending_score(self, activation_info):
+        pass
+
+    def clear_caches(self):
+        pass
+
+
+class FakeDB:
+    db_height = 10
+    blocking_channel_hashes = set()
+    filtering_channel_hashes = set()
+
+    def __init__(self):
+        self.search_index = FakeSearchIndex()
+        self.amounts = {}
+
+    def claims_producer(self, claim_hashes):
+        return [{'claim_id': claim_hash.hex(), 'amount': self.amounts[claim_hash]} for claim_hash in claim_hashes]
+
+    def get_streams_and_channels_reposted_by_channel_hashes(self, reposter_channel_hashes):
+        return {}, {}
+
+
+class TestSearchIndexWorker(AsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = FakeDB()
+        self.bp = BlockProcessor.__new__(BlockProcessor)
+        self.bp.db = self.db
+        self.bp.logger = class_logger('lbry.wallet.server.block_processor', 'BlockProcessor')
+        self.bp.height = 0
+        self.bp.state_lock = asyncio.Lock()
+        self.bp._chain_executor = ThreadPoolExecutor(1)
+        self.bp._es_doc_cache = LRUCache(2 ** 14)
+        self.bp.es_sync_height = 0
+        self.bp.removed_claims_to_send_es = set()
+        self.bp.touched_claims_to_send_es = set()
+        self.bp.activation_info_to_send_es = defaultdict(list)
+        self.bp._es_queue = asyncio.Queue(maxsize=1)
+        self.bp._es_task = asyncio.create_task(self.bp._es_worker())
+
+    async def asyncTearDown(self):
+        self.bp._es_task.cancel()
+        self.bp._chain_executor.shutdown(wait=True)
+
+    async def advance(self, *claim_hashes: bytes):
+        self.bp.height += 1
+        for claim_hash in claim_hashes:
+            self.db.amounts[claim_hash] = self.db.amounts.get(claim_hash, 0) + 1
+        self.bp.touched_claims_to_send_es.update(claim_hashes)
+        await self.bp._queue_es_update()
+
+    async def test_update_is_read_when_queued(self):
+        self.db.search_index.blocked.clear()
+        await self.advance(b'\x01' * 20)
+        # changes made by the next block must not leak into the queued update
+        self.db.amounts[b'\x01' * 20] = 100
+        self.db.search_index.blocked.set()
+        await self.bp._wait_for_es_updates()
+        self.assertListEqual(
+            [('update', {'claim_id': '01' * 20, 'amount': 1})], self.db.search_index.indexed
+        )
+        self.assertEqual(1, self.bp.es_sync_height)
+
+    async def test_worker_error_is_raised_to_a_blocked_put(self):
+        self.db.search_index.blocked.clear()
+        self.db.search_index.error = ConnectionError('es went away')
+        await self.advance(b'\x01' * 20)  # taken by the worker, which waits on ES
+        await asyncio.sleep(0)
+        await self.advance(b'\x02' * 20)  # fills the queue
+        blocked_put = asyncio.create_task(self.advance(b'\x03' * 20))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked_put.done())
+        with self.assertLogs('lbry.wallet.server.block_processor', 'ERROR'):
+            self.db.search_index.blocked.set()
+            with self.assertRaises(ConnectionError):
+                await blocked_put
+        with self.assertRaises(ConnectionError):
+            await self.bp._wait_for_es_updates()
+        self.assertEqual(0, self.bp.es_sync_height)
+
+    async def test_queued_updates_are_sent_on_shutdown(self):
+        self.db.search_index.blocked.clear()
+        await self.advance(b'\x01' * 20)  # taken by the worker, which waits on ES
+        await asyncio.sleep(0)
+        await self.advance(b'\x02' * 20)  # left in the queue
+        self.assertEqual(1, self.bp._es_queue.qsize())
+        stop = asyncio.create_task(self.bp._stop_es_worker())
+        await asyncio.sleep(0.01)
+        self.assertFalse(stop.done())
+        self.db.search_index.blocked.set()
+        await stop
+        self.assertListEqual(
+            [('update', {'claim_id': claim_id * 20, 'amount': 1}) for claim_id in ('01', '02')],
+            self.db.search_index.indexed
+        )
+        self.assertEqual(2, self.bp.es_sync_height)
+        await asyncio.sleep(0)
+        self.assertTrue(self.bp._es_task.cancelled())
+
+    async def test_unchanged_claims_are_not_sent_again(self):
+        claim = {'claim_id': '01' * 20, 'amount': 1}
+        await self.bp._send_claims_to_es(set(), [claim])
+        await self.bp._send_claims_to_es(set(), [dict(claim)])
+        self.assertListEqual([('update', claim)], self.db.search_index.indexed)
+        await self.bp._send_claims_to_es(set(), [dict(claim, amount=2)])
+        self.assertListEqual(
+            [('update', claim), ('update', dict(claim, amount=2))], self.db.search_index.indexed
+        )
+
+    async def test_claims_are_sent_again_after_a_failed_send(self):
+        claim = {'claim_id': '01' * 20, 'amount': 1}
+        self.db.search_index.error = ConnectionError('es went away')
+        with self.assertRaises(ConnectionError):
+            await self.bp._send_claims_to_es(set(), [claim])
+        self.db.search_index.error = None
+        await self.bp._send_claims_to_es(set(), [claim])
+        self.assertListEqual([('update', claim)] * 2, self.db.search_index.indexed)
+
+    async def test_claims_that_failed_to_index_are_sent_again(self):
+        claim = {'claim_id': '01' * 20, 'amount': 1}
+        self.db.search_index.failed = {claim['claim_id']}
+        await self.bp._send_claims_to_es(set(), [claim])
+        self.db.search_index.failed = set()
+        await self.bp._send_claims_to_es(set(), [claim])
+        await self.bp._send_claims_to_es(set(), [claim])
+        self.assertListEqual([('update', claim)] * 2, self.db.search_index.indexed)
@@ -0,0 +1,204 @@
+import os
+import asyncio
+import shutil
+import tempfile
+
+from lbry.testcase import AsyncioTestCase
+from lbry.wallet.server.coin import LBCRegTest
+from lbry.wallet.server.hash import double_sha256, hash_to_hex_str
+from lbry.wallet.server.mempool import MemPool
+from lbry.wallet.server.util import pack_le_int32, pack_le_int64, pack_le_uint32, pack_varint, pack_varbytes
+
+
+def make_raw_tx(prevouts, values, n=0):
+    """Serialize a transaction spending prevouts to P2PKH outputs of the given values."""
+    raw_tx = pack_le_int32(1) + pack_varint(len(prevouts))
+    for prev_hash, prev_idx in prevouts:
+        raw_tx += prev_hash + pack_le_uint32(prev_idx) + pack_varbytes(b'') + pack_le_uint32(0xffffffff)
+    raw_tx += pack_varint(len(values))
+    for value in values:
+        script = b'\x76\xa9\x14' + bytes([n]) * 20 + b'\x88\xac'
+        raw_tx += pack_le_int64(value) + pack_varbytes(script)
+    return raw_tx + pack_le_uint32(0)
+
+
+class FakeDaemon:
+    def __init__(self):
+        self.raw_txs = {}
+        self.fetched = []
+        self.heights = []
+
+    async def mempool_hashes_at_height(self):
+        return self.heights.pop(0), [hash_to_hex_str(tx_hash) for tx_hash in self.raw_txs]
+
+    def add(self, raw_tx):
+        tx_hash = double_sha256(raw_tx)
+        self.raw_txs[tx_hash] = raw_tx
+        return tx_hash
+
+    async def getrawtransactions(self, hex_hashes):
+        hex_hashes = list(hex_hashes)
+        self.fetched.extend(hex_hashes)
+        by_hex = {hash_to_hex_str(tx_hash): raw_tx for tx_hash, raw_tx in self.raw_txs.items()}
+        return [by_hex.get(hex_hash) for hex_hash in hex_hashes]
+
+
+class FakeEnv:
+    def __init__(self, db_dir):
+        self.db_dir = db_dir
+
+
+class FakeDB:
+    def __init__(self, db_dir):
+        self.env = FakeEnv(db_dir)
+        self.utxos = {}
+
+    async def lookup_utxos(self, prevouts):
+        return [self.utxos.get(prevout) for prevout in prevouts]
+
+
+class MemPoolTestCase(AsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.daemon = FakeDaemon()
+        self.db = FakeDB(self.db_dir)
+        self.mempool = self.make_mempool()
+        self.confirmed_hash = b'\xff' * 32
+        self.db.utxos[(self.confirmed_hash, 0)] = (b'\x00' * 11, 1000)
+
+    def make_mempool(self):
+        return MemPool(LBCRegTest, self.daemon, self.db, asyncio.Lock())
+
+    async def refresh(self, mempool=None):
+        mempool = mempool or self.mempool
+        return await mempool._process_mempool(set(self.daemon.raw_txs))
+
+
+class TestMemPoolCache(MemPoolTestCase):
+    async def test_cache_round_trip(self):
+        tx_hash = self.daemon.add(make_raw_tx([(self.confirmed_hash, 0)], [600, 300]))
+        await self.refresh()
+        self.mempool._write_cache()
+
+        restarted = self.make_mempool()
+        await restarted._load_cache()
+        self.assertFalse(os.path.exists(restarted._cache_path()))
+        self.assertSetEqual({tx_hash}, set(restarted._cached_txs))
+        self.daemon.fetched.clear()
+        await self.refresh(restarted)
+        self.assertListEqual([], self.daemon.fetched)
+        self.assertDictEqual(self.mempool.txs, restarted.txs)
+        self.assertEqual(100, restarted.txs[tx_hash].fee)
+
+    async def test_txs_that_left_the_mempool_are_dropped_from_the_cache(self):
+        mined = self.daemon.add(make_raw_tx([(self.confirmed_hash, 0)], [900]))
+        still_pending = self.daemon.add(make_raw_tx([(mined, 0)], [800]))
+        await self.refresh()
+        self.mempool._write_cache()
+
+        del self.daemon.raw_txs[mined]
+        self.db.utxos[(mined, 0)] = (b'\x00' * 11, 900)
+        restarted = self.make_mempool()
+        await restarted._load_cache()
+        await self.refresh(restarted)
+        self.assertSetEqual({still_pending}, set(restarted.txs))
+        self.assertDictEqual({}, restarted._cached_txs)
+
+    async def test_txs_not_matching_their_hash_are_dropped_from_the_cache(self):
+        tx_hash = self.daemon.add(make_raw_tx([(self.confirmed_hash, 0)], [900]))
+        await self.refresh()
+        self.mempool.txs[tx_hash].raw_tx = make_raw_tx([(self.confirmed_hash, 0)], [1000])
+        self.mempool._write_cache()
+
+        restarted = self.make_mempool()
+        await restarted._load_cache()
+        self.assertDictEqual({}, restarted._cached_txs)
+
+
+class TestAcceptTransactions(MemPoolTestCase):
+    def deserialize(self, *raw_txs):
+        return self.mempool._deserialize_txs([double_sha256(raw_tx) for raw_tx in raw_txs], raw_txs)
+
+    def accept(self, tx_map, prevouts=()):
+        utxo_map = {prevout: self.db.utxos[prevout] for prevout in prevouts}
+        touched = set()
+        deferred, unspent = self.mempool._accept_transactions(tx_map, utxo_map, touched)
+        return deferred, unspent, touched
+
+    def test_child_received_before_parent(self):
+        parent = make_raw_tx([(self.confirmed_hash, 0)], [900], n=1)
+        child = make_raw_tx([(double_sha256(parent), 0)], [800], n=2)
+        grandchild = make_raw_tx([(double_sha256(child), 0)], [700], n=3)
+        deferred, unspent, touched = self.accept(
+            self.deserialize(grandchild, child, parent), [(self.confirmed_hash, 0)]
+        )
+        self.assertDictEqual({}, deferred)
+        self.assertDictEqual({}, unspent)
+        txs = self.mempool.txs
+        self.assertSetEqual({double_sha256(raw_tx) for raw_tx in (parent, child, grandchild)}, set(txs))
+        self.assertListEqual(txs[double_sha256(parent)].out_pairs, txs[double_sha256(child)].in_pairs)
+        self.assertListEqual(txs[double_sha256(child)].out_pairs, txs[double_sha256(grandchild)].in_pairs)
+        self.assertEqual(100, txs[double_sha256(grandchild)].fee)
+        self.assertEqual(4, len(touched))
+
+    def test_missing_parent(self):
+        orphan = make_raw_tx([(b'\xee' * 32, 0)], [900], n=1)
+        child = make_raw_tx([(double_sha256(orphan), 0)], [800], n=2)
+        tx_map = self.deserialize(child, orphan)
+        deferred, _, touched = self.accept(dict(tx_map))
+        self.assertDictEqual(tx_map, deferred)
+        self.assertDictEqual({}, self.mempool.txs)
+        self.assertDictEqual({}, self.mempool.hashXs)
+        self.assertSetEqual(set(), touched)
+
+    def test_double_spend(self):
+        first = make_raw_tx([(self.confirmed_hash, 0)], [900], n=1)
+        second = make_raw_tx([(self.confirmed_hash, 0)], [800], n=2)
+        child_of_second = make_raw_tx([(double_sha256(second), 0)], [700], n=3)
+        tx_map = self.deserialize(first, second, child_of_second)
+        deferred, unspent, _ = self.accept(dict(tx_map), [(self.confirmed_hash, 0)])
+        self.assertSetEqual({double_sha256(first)}, set(self.mempool.txs))
+        self.assertSetEqual({double_sha256(second), double_sha256(child_of_second)}, set(deferred))
+        self.assertDictEqual({}, unspent)
+
+
+class TestUnconfirmedInputs(MemPoolTestCase):
+    async def test_parent_confirming(self):
+        parent = self.daemon.add(make_raw_tx([(self.confirmed_hash, 0)], [900], n=1))
+        child = self.daemon.add(make_raw_tx([(parent, 0)], [800], n=2))
+        await self.refresh()
+        child_hashX = self.mempool.txs[child].out_pairs[0][0]
+        self.assertEqual(0, self.mempool.get_mempool_height(parent))
+        self.assertEqual(-1, self.mempool.get_mempool_height(child))
+        self.assertTrue(self.mempool.transaction_summaries(child_hashX)[0].has_unconfirmed_inputs)
+
+        # the parent is mined, the next refresh drops it from the mempool
+        del self.daemon.raw_txs[parent]
+        self.db.utxos[(parent, 0)] = self.mempool.txs[parent].out_pairs[0]
+        await self.refresh()
+        self.assertEqual(-2, self.mempool.get_mempool_height(parent))
+        self.assertEqual(0, self.mempool.get_mempool_height(child))
+        self.assertFalse(self.mempool.transaction_summaries(child_hashX)[0].has_unconfirmed_inputs)
+
+
+class TestRefreshHashes(MemPoolTestCase):
+    async def test_mempool_is_read_again_when_a_block_arrives(self):
+        tx_hash = self.daemon.add(make_raw_tx([(self.confirmed_hash, 0)], [900]))
+        self.daemon.heights = [None, 101]
+        notified = []
+
+        async def notify_sessions(height, touched, new_touched):
+            notified.append((height, new_touched))
+
+        self.mempool.notify_sessions = notify_sessions
+        self.mempool._highest_block = 101
+        synchronized = asyncio.Event()
+        refresh = asyncio.create_task(self.mempool._refresh_hashes(synchronized))
+        try:
+            await asyncio.wait_for(synchronized.wait(), 1)
+        finally:
+            refresh.cancel()
+        self.assertListEqual([], self.daemon.heights)
+        self.assertSetEqual({tx_hash}, set(self.mempool.txs))
+        self.assertListEqual([(101, set(self.mempool.txs[tx_hash].hashXs))], notified)
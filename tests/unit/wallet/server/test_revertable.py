@@ -103,6 +103,22 @@ class TestRevertableOpStack(unittest.TestCase):
         self.process_stack()
         self.assertDictEqual({key2: val3}, self.fake_db)
 
+    def test_iter_final_ops(self):
+        key1 = ClaimToTXOPrefixRow.pack_key(b'\x01' * 20)
+        key2 = ClaimToTXOPrefixRow.pack_key(b'\x02' * 20)
+        val1 = ClaimToTXOPrefixRow.pack_value(1, 0, 1, 0, 1, False, 'derp')
+        val2 = ClaimToTXOPrefixRow.pack_value(1, 0, 1, 0, 1, False, 'oops')
+        self.stack.append_op(RevertablePut(key1, val1))
+        self.stack.append_op(RevertablePut(key2, val1))
+        self.process_stack()
+
+        self.update(key1, val1, key1, val2)
+        self.stack.append_op(RevertableDelete(key2, val1))
+        self.assertEqual(3, len(self.stack))
+        self.assertListEqual(
+            [RevertablePut(key1, val2), RevertableDelete(key2, val1)], list(self.stack.iter_final_ops())
+        )
+
 
 class TestRevertablePrefixDB(unittest.TestCase):
     def setUp(self):
@@ -151,3 +167,42 @@ class TestRevertablePrefixDB(unittest.TestCase):
         self.assertEqual(10000000, self.db.claim_takeover.get(name).height)
         self.db.rollback(10000000)
         self.assertIsNone(self.db.claim_takeover.get(name))
+
+    def test_stage_short_ids(self):
+        name = 'derp'
+        claim_id = (20 * b'\x01').hex()
+        self.db.claim_short_id.stage_short_ids_put(name, claim_id, 1, 0, 2, 0)
+        self.db.commit(1)
+        for prefix_len in range(10):
+            self.assertEqual(2, self.db.claim_short_id.get(name, claim_id[:prefix_len + 1], 1, 0).tx_num)
+        self.assertIsNone(self.db.claim_short_id.get(name, claim_id[:11], 1, 0))
+        self.db.claim_short_id.stage_short_ids_delete(name, claim_id, 1, 0, 2, 0)
+        self.db.commit(2)
+        self.assertListEqual([], list(self.db.claim_short_id.iterate(prefix=(name,))))
+
+    def test_multi_get(self):
+        name = 'derp'
+        claim_hash1 = 20 * b'\x01'
+        claim_hash2 = 20 * b'\x02'
+        self.db.claim_takeover.stage_put((name,), (claim_hash1, 1))
+        self.db.claim_takeover.stage_put(('herp',), (claim_hash2, 2))
+        self.db.commit(1)
+        self.assertListEqual(
+            [claim_hash2, None, claim_hash1, claim_hash2],
+            [v and v.claim_hash for v in self.db.claim_takeover.multi_get([('herp',), ('nope',), (name,), ('herp',)])]
+        )
+
+    def test_stage_raw_ops(self):
+        claim_hash = 20 * b'\x01'
+        ops = (
+            RevertablePut(*self.db.activated.pack_item(1, 100, 1, 10, claim_hash, 'derp')),
+            RevertablePut(*self.db.pending_activation.pack_item(10, 1, 100, 1, claim_hash, 'derp')),
+        )
+        self.db.stage_raw_ops(ops)
+        self.db.commit(1)
+        self.assertEqual(10, self.db.activated.get(1, 100, 1).height)
+        self.assertEqual(claim_hash, self.db.pending_activation.get(10, 1, 100, 1).claim_hash)
+        self.db.stage_raw_ops(op.invert() for op in ops)
+        self.db.commit(2)
+        self.assertIsNone(self.db.activated.get(1, 100, 1))
+        self.assertIsNone(self.db.pending_activation.get(10, 1, 100, 1))